@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'investor_api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'investor_api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'application.urls'
@@ -138,9 +140,49 @@ CELERY_RESULT_BACKEND = "redis://redis:6379/0"
 CELERY_IMPORTS = [
     "investor_api.tasks",
 ]
+# Import jobs are acknowledged late so a crashed worker's job is redelivered
+# and resumes; the visibility timeout must outlast the longest import.
+CELERY_BROKER_TRANSPORT_OPTIONS = {"visibility_timeout": 60 * 60 * 12}
 
 # Celery Beat
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULE = {
+    "purge-staged-csv": {
+        "task": "investor_api.tasks.purge_staged_csv",
+        "schedule": 60 * 60,
+    },
+}
+
+
+# CSV UPLOADS
+
+# Uploads are staged here until the worker imports them, so the directory
+# must be shared by the web and worker containers.
+CSV_SPOOL_DIR = os.environ.get("CSV_SPOOL_DIR", BASE_DIR / "spool")
+CSV_SPOOL_COMPRESS = True
+# Staged files left behind by failed imports are deleted after this many seconds.
+CSV_SPOOL_MAX_AGE = 60 * 60 * 24
+# Imports are split by loan identifier hash into this many shards, processed
+# in parallel by the Celery workers. 1 runs every import in a single task.
+# Only raise it with a database that takes concurrent writers, like
+# PostgreSQL, and a worker concurrency to match: SQLite serializes writers,
+# so shards would wait on its lock and fail after its timeout.
+CSV_IMPORT_SHARDS = int(os.environ.get("CSV_IMPORT_SHARDS", 1))
+
+
+# METRICS
+
+# Request latency and SQL metrics, and CSV import phase durations, exposed
+# in the Prometheus text format at /metrics.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# /metrics is only served to admins, and to scrapers sending this token in
+# an "Authorization: Bearer <token>" header. METRICS_PUBLIC=1 opens it to all.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0") == "1"
+# Return each request's latency and SQL time in a Server-Timing header.
+METRICS_SERVER_TIMING = DEBUG
+# Profiles of requests sent by admins with ?profile=1 are kept this long.
+PROFILE_TIMEOUT = 60 * 60 * 24
 
 
 # REST FRAMEWORK
@@ -151,7 +193,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'investor_api.authentication.StatelessJWTAuthentication',
     ],
 }
 
@@ -161,6 +203,10 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Tokens carry the role flags, so requests are authenticated without
+    # loading the user.
+    'TOKEN_OBTAIN_SERIALIZER': 'investor_api.authentication.RoleTokenObtainPairSerializer',
+    'TOKEN_USER_CLASS': 'investor_api.authentication.RoleTokenUser',
 }
 
 AUTH_USER_MODEL = 'investor_api.CustomUser'
@@ -17,11 +17,18 @@ from django.contrib import admin
 from django.urls import path
 from investor_api.views import (LoanList,
                                 LoanDetail,
+                                LoanExport,
                                 CashFlowList,
+                                CashFlowBulkCreate,
                                 CashFlowDetail,
+                                CashFlowExport,
                                 CsvUploadView,
+                                ImportJobDetail,
                                 InvestmentStatisticsView,
+                                InvestmentSeriesView,
                                 InvestmentStatisticsTemplateView,
+                                MetricsView,
+                                ProfileDetail,
                                 CustomUserList
                                 )
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -31,11 +38,18 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('loans/', LoanList.as_view()),
     path('loans/<int:pk>/', LoanDetail.as_view()),
+    path('loans/export/', LoanExport.as_view()),
     path('cashflows/', CashFlowList.as_view()),
+    path('cashflows/bulk/', CashFlowBulkCreate.as_view()),
     path('cashflows/<int:pk>/', CashFlowDetail.as_view()),
+    path('cashflows/export/', CashFlowExport.as_view()),
     path('csv/upload/', CsvUploadView.as_view()),
+    path('csv/jobs/<int:pk>/', ImportJobDetail.as_view()),
     path('statistics/basic/', InvestmentStatisticsView.as_view()),
     path('statistics/chart/', InvestmentStatisticsTemplateView.as_view()),
+    path('statistics/series/', InvestmentSeriesView.as_view()),
     path('users/', CustomUserList.as_view()),
+    path('metrics', MetricsView.as_view()),
+    path('profiles/<str:profile_id>/', ProfileDetail.as_view()),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
 ]
@@ -0,0 +1,64 @@
+"""JWT authentication without a user query per request.
+
+Tokens from ``/token/`` carry the user's role flags as claims, and API
+requests are authenticated from those claims alone, as a
+:class:`RoleTokenUser`. Instead of the user row, every request checks the
+cache for a revocation of the user's tokens, see ``revocation``.
+"""
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication,
+    JWTStatelessUserAuthentication,
+)
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .revocation import tokens_revoked_at
+
+
+ROLE_CLAIMS = ["is_staff", "is_superuser", "is_investor", "is_analyst"]
+# Issue time in milliseconds: ``iat`` is in seconds, too coarse to tell a
+# token issued right after a revocation from one issued before it.
+ISSUED_AT_MS_CLAIM = "iat_ms"
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["username"] = user.get_username()
+        for claim in ROLE_CLAIMS:
+            token[claim] = getattr(user, claim)
+        token[ISSUED_AT_MS_CLAIM] = int(token.current_time.timestamp() * 1000)
+        return token
+
+
+class RoleTokenUser(TokenUser):
+    """A user built from the claims of a token, see ``ROLE_CLAIMS``."""
+
+    @cached_property
+    def is_investor(self):
+        return self.token.get("is_investor", False)
+
+    @cached_property
+    def is_analyst(self):
+        return self.token.get("is_analyst", False)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """Authenticate from the token's claims, without loading the user.
+
+    Tokens issued before the role claims were added still load the user.
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in ROLE_CLAIMS):
+            return JWTAuthentication.get_user(self, validated_token)
+        user = super().get_user(validated_token)
+        revoked_at = tokens_revoked_at(user.id)
+        issued_at = validated_token.get(
+            ISSUED_AT_MS_CLAIM, validated_token.get("iat", 0) * 1000
+        )
+        if revoked_at is not None and issued_at <= revoked_at:
+            raise AuthenticationFailed("Token has been revoked.", code="token_revoked")
+        return user
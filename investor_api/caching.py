@@ -0,0 +1,294 @@
+"""Versioned cache namespaces.
+
+Every cached value is stored under a key that embeds the current data
+version of its namespace. Invalidating a namespace only increments that
+version, so stale entries simply stop being read and expire on their own,
+without touching unrelated keys in the cache.
+
+Single objects are cached the same way, under a version of their own: see
+:func:`cached_object` and :func:`invalidate_objects`.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+from . import metrics
+
+
+STATISTICS = "statistics"
+LOANS = "loans"
+CASH_FLOWS = "cashflows"
+
+# Kinds of the objects cached by ``cached_object``.
+LOAN_OBJECT = "loan"
+CASH_FLOW_OBJECT = "cashflow"
+
+LOAN_NAMESPACES = (LOANS, STATISTICS)
+CASH_FLOW_NAMESPACES = (CASH_FLOWS, LOANS, STATISTICS)
+
+CHARTS_TIMEOUT = 60 * 60 * 24
+DEFAULT_TIMEOUT = 60 * 15
+# Values of older data versions are served while the current one is computed.
+STALE_TIMEOUT = 60 * 60 * 24
+OBJECT_TIMEOUT = 60 * 60
+SINGLE_FLIGHT_LOCK_TIMEOUT = 60
+SINGLE_FLIGHT_WAIT = 5
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+LATEST_CHARTS_KEY = "charts:latest"
+
+# Sent after the data version of ``namespaces`` has been bumped.
+data_version_changed = Signal()
+
+_deferred = threading.local()
+
+
+def _version_key(namespace):
+    return "data_version:%s" % namespace
+
+
+def get_data_version(namespace):
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed with the clock rather than 1 so a version evicted from the
+        # cache never comes back with a number that was already used.
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            get_data_version(namespace)
+    data_version_changed.send(sender=None, namespaces=namespaces)
+
+
+def data_version_etag(request, version):
+    """ETag of the response to ``request`` for the data ``version``."""
+    representation = "%s:%s:%s" % (
+        version,
+        request.get_full_path(),
+        request.META.get("HTTP_ACCEPT", ""),
+    )
+    return quote_etag(hashlib.md5(representation.encode("utf-8")).hexdigest())
+
+
+def data_version_condition(namespace):
+    """``condition`` decorator for GET views that only change with ``namespace``.
+
+    The ETag is derived from the current data version, so a client that
+    already has the current content gets a 304 before the view runs any
+    query. Views that can serve the content of an older version, like
+    :func:`single_flight` values, must set the ETag of that version
+    themselves, with :func:`data_version_etag`. There is no Last-Modified:
+    a date in seconds cannot tell apart versions bumped within one second.
+    """
+
+    def etag(request, *args, **kwargs):
+        return data_version_etag(request, get_data_version(namespace))
+
+    return condition(etag_func=etag)
+
+
+def versioned_key(namespace, *parts, version=None):
+    if version is None:
+        version = get_data_version(namespace)
+    return ":".join([namespace, "v%s" % version] + [str(part) for part in parts])
+
+
+class _PendingBump:
+    def __init__(self):
+        self.namespaces = set()
+
+    def __call__(self):
+        bump_data_version(*sorted(self.namespaces))
+
+
+class _PendingObjects:
+    def __init__(self):
+        self.objects = set()
+
+    def __call__(self):
+        _forget_object_versions(self.objects)
+
+
+def _pending(cls, connection, using):
+    """The ``cls`` callback to run when the transaction commits, added once."""
+    for entry in connection.run_on_commit:
+        if isinstance(entry[1], cls):
+            return entry[1]
+    pending = cls()
+    transaction.on_commit(pending, using=using)
+    return pending
+
+
+def invalidate(*namespaces, using=None):
+    """Bump ``namespaces`` once, when the current transaction commits.
+
+    Repeated calls inside the same transaction are merged into a single bump,
+    and inside :func:`deferred_invalidation` they are merged until it exits.
+    """
+    pending = getattr(_deferred, "namespaces", None)
+    if pending is not None:
+        pending.update(namespaces)
+        return
+
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        bump_data_version(*namespaces)
+        return
+
+    _pending(_PendingBump, connection, using).namespaces.update(namespaces)
+
+
+@contextmanager
+def deferred_invalidation(apply=True):
+    """Collect every invalidation in the block and apply them once on exit.
+
+    With ``apply=False`` they are dropped instead, for work whose caller
+    invalidates everything itself afterwards.
+    """
+    if getattr(_deferred, "namespaces", None) is not None:
+        yield
+        return
+
+    _deferred.namespaces = set()
+    try:
+        yield
+    finally:
+        namespaces = _deferred.namespaces
+        _deferred.namespaces = None
+        if namespaces and apply:
+            invalidate(*namespaces)
+
+
+def _object_version_key(kind, pk):
+    return "object_version:%s:%s" % (kind, pk)
+
+
+def _forget_object_versions(objects):
+    cache.delete_many([_object_version_key(kind, pk) for kind, pk in objects])
+
+
+def invalidate_objects(*objects, using=None):
+    """Drop the cached payloads of ``objects``, ``(kind, pk)`` pairs.
+
+    Like :func:`invalidate`, this happens when the current transaction
+    commits, but other objects and the data versions are left alone.
+    """
+    if not objects:
+        return
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        _forget_object_versions(objects)
+        return
+    _pending(_PendingObjects, connection, using).objects.update(objects)
+
+
+def cached_object(kind, pk, variant, compute, timeout=OBJECT_TIMEOUT):
+    """Return ``compute()``, the payload of one object, read through the cache.
+
+    ``variant`` tells apart payloads of the same object, such as its sparse
+    fieldsets. They are all cached until :func:`invalidate_objects` is called
+    for the object. Hits and misses are counted per ``kind`` in ``/metrics``.
+    """
+    key = "objects:%s:%s:%s" % (kind, pk, variant)
+    version_key = _object_version_key(kind, pk)
+    found = cache.get_many([key, version_key])
+    entry, version = found.get(key), found.get(version_key)
+    if entry is not None and entry["version"] == version:
+        metrics.count_object_cache(kind, hit=True)
+        return entry["value"]
+
+    metrics.count_object_cache(kind, hit=False)
+    if version is None:
+        # Random, so a version that was forgotten never comes back. Taken
+        # before computing, so a write committed meanwhile is not hidden.
+        cache.add(version_key, uuid.uuid4().hex, timeout=STALE_TIMEOUT)
+        version = cache.get(version_key)
+    value = compute()
+    if version is not None:
+        cache.set(key, {"version": version, "value": value}, timeout=timeout)
+    return value
+
+
+def _store_latest(key, version, value, timeout):
+    latest = cache.get(key)
+    if latest is None or latest["version"] <= version:
+        cache.set(key, {"version": version, "value": value}, timeout=timeout)
+
+
+def single_flight(
+    namespace, name, compute, timeout=DEFAULT_TIMEOUT, wait=SINGLE_FLIGHT_WAIT
+):
+    """Return ``(compute(), version)``, cached under the data version of ``namespace``.
+
+    After an invalidation only one caller recomputes the value, while holding
+    a lock in the cache. The others get the value of an older data version
+    when there is one; otherwise they wait up to ``wait`` seconds for it and
+    then compute it themselves. ``version`` is the data version the value
+    was computed for, which is older than the current one for stale values.
+    """
+    version = get_data_version(namespace)
+    key = versioned_key(namespace, name, version=version)
+    value = cache.get(key)
+    if value is not None:
+        return value, version
+
+    lock_key = versioned_key(namespace, name, "lock", version=version)
+    latest_key = "%s:latest:%s" % (namespace, name)
+    deadline = time.monotonic() + wait
+    while not cache.add(lock_key, True, timeout=SINGLE_FLIGHT_LOCK_TIMEOUT):
+        latest = cache.get(latest_key)
+        if latest is not None:
+            return latest["value"], latest["version"]
+        if time.monotonic() >= deadline:
+            return compute(), version
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value, version
+
+    try:
+        value = compute()
+        cache.set(key, value, timeout=timeout)
+        _store_latest(latest_key, version, value, STALE_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+    return value, version
+
+
+def get_rendered_charts():
+    """Return ``(charts, is_current)`` for the statistics charts.
+
+    ``charts`` is the rendering for the current data version when there is
+    one, otherwise the most recent older rendering, or ``None`` before the
+    first rendering has finished.
+    """
+    charts = cache.get(versioned_key(STATISTICS, "charts"))
+    if charts is not None:
+        return charts, True
+    latest = cache.get(LATEST_CHARTS_KEY)
+    return (latest["charts"] if latest else None), False
+
+
+def store_rendered_charts(version, charts):
+    cache.set(
+        versioned_key(STATISTICS, "charts", version=version),
+        charts,
+        timeout=CHARTS_TIMEOUT,
+    )
+    latest = cache.get(LATEST_CHARTS_KEY)
+    if latest is None or latest["version"] <= version:
+        cache.set(
+            LATEST_CHARTS_KEY, {"version": version, "charts": charts}, timeout=None
+        )
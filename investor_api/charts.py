@@ -0,0 +1,65 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+from .statistics import cumulative_series, loan_totals
+import io
+import base64
+
+
+def _png_data_uri(fig):
+    canvas = FigureCanvas(fig)
+    buf = io.BytesIO()
+    canvas.print_png(buf)
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def render_investment_distribution(totals):
+    investment_distribution = [total["invested_amount"] for total in totals]
+    labels = [total["identifier"] for total in totals]
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot(111)
+    ax.pie(investment_distribution, labels=labels)
+    ax.set_title("Investment Distribution")
+    return _png_data_uri(fig)
+
+
+def render_investment_repayment(totals):
+    labels = [total["identifier"] for total in totals]
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot(111)
+    ax.bar(
+        labels,
+        [-abs(total["invested_amount"]) for total in totals],
+        label="Investment",
+    )
+    ax.bar(labels, [total["repaid_amount"] for total in totals], label="Repayment")
+    ax.set_title("Investment and Repayment by Loan")
+    ax.set_xlabel("Loan Identifier")
+    ax.set_ylabel("Amount")
+    ax.legend()
+    return _png_data_uri(fig)
+
+
+def render_investment_over_time(series):
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot(111)
+    date_labels = [point["date"] for point in series]
+    ax.plot(
+        date_labels, [point["invested_amount"] for point in series], label="Investment"
+    )
+    ax.plot(
+        date_labels, [point["repaid_amount"] for point in series], label="Repayment"
+    )
+    ax.set_title("Investment and Repayment over Time")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Amount")
+    ax.legend()
+    return _png_data_uri(fig)
+
+
+def render_charts():
+    totals = loan_totals()
+    return {
+        "investment_distribution": render_investment_distribution(totals),
+        "investment_repayment": render_investment_repayment(totals),
+        "investment_over_time": render_investment_over_time(cumulative_series()),
+    }
@@ -0,0 +1,131 @@
+"""Fast read path for large loan and cash-flow listings.
+
+Rows are built straight from ``values_list()`` tuples and encoded with a
+reused C-accelerated ``json.JSONEncoder``, skipping DRF serializer and field
+instantiation per row. The output is byte-for-byte what ``JSONRenderer``
+produces for ``LoanDetailSerializer`` and ``CashFlowSerializer``.
+"""
+import json
+from collections import defaultdict
+from django.db import models
+from .models import CashFlow, Loan
+from .serializers import CashFlowSerializer, LoanDetailSerializer
+
+
+CHUNK_SIZE = 2000
+
+LOAN_FIELDS = [
+    field for field in LoanDetailSerializer.Meta.fields if field != "cash_flows"
+]
+CASH_FLOW_FIELDS = list(CashFlowSerializer.Meta.fields)
+
+# Same settings as rest_framework.renderers.JSONRenderer with the defaults
+# COMPACT_JSON, UNICODE_JSON and STRICT_JSON.
+_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    allow_nan=False,
+    separators=(",", ":"),
+    check_circular=False,
+)
+
+
+def encode(data):
+    return (
+        _encoder.encode(data)
+        .replace("\u2028", "\\u2028")
+        .replace("\u2029", "\\u2029")
+        .encode("utf-8")
+    )
+
+
+def _iso_date(value):
+    return None if value is None else value.isoformat()
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _converters(model, fields):
+    converters = []
+    for name in fields:
+        field = model._meta.get_field(name)
+        if isinstance(field, models.DateField):
+            converters.append(_iso_date)
+        elif isinstance(field, models.FloatField):
+            converters.append(_float)
+        else:
+            converters.append(None)
+    return converters
+
+
+def _make_row(fields, converters, values):
+    return {
+        field: value if convert is None else convert(value)
+        for field, convert, value in zip(fields, converters, values)
+    }
+
+
+def _chunks(queryset, chunk_size):
+    chunk = []
+    for values in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def cash_flow_rows(queryset, chunk_size=CHUNK_SIZE):
+    fields = CASH_FLOW_FIELDS
+    converters = _converters(CashFlow, fields)
+    for values in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield _make_row(fields, converters, values)
+
+
+def loan_rows(queryset, fields=None, chunk_size=CHUNK_SIZE):
+    """Yield loan rows for ``queryset``, with only ``fields`` when given.
+
+    Nested cash flows are loaded with one query per chunk of loans.
+    """
+    fields = [
+        field
+        for field in LoanDetailSerializer.Meta.fields
+        if fields is None or field in fields
+    ]
+    columns = [field for field in fields if field != "cash_flows"]
+    nested = "cash_flows" in fields
+    converters = _converters(Loan, columns)
+
+    values_list = queryset.values_list("identifier", *columns)
+    for chunk in _chunks(values_list, chunk_size):
+        cash_flows = defaultdict(list)
+        if nested:
+            cash_flows_queryset = CashFlow.objects.filter(
+                loan_identifier__in=[values[0] for values in chunk]
+            ).order_by("pk")
+            for row in cash_flow_rows(cash_flows_queryset, chunk_size):
+                cash_flows[row["loan_identifier"]].append(row)
+
+        for values in chunk:
+            row = _make_row(columns, converters, values[1:])
+            if nested:
+                row["cash_flows"] = cash_flows.get(values[0], [])
+            yield row
+
+
+def stream_json_array(rows, rows_per_chunk=500):
+    """Encode ``rows`` as one JSON array, yielding it in byte chunks."""
+    yield b"["
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(encode(row))
+        if len(buffer) >= rows_per_chunk:
+            yield (b"" if first else b",") + b",".join(buffer)
+            buffer = []
+            first = False
+    if buffer:
+        yield (b"" if first else b",") + b",".join(buffer)
+    yield b"]"
@@ -0,0 +1,528 @@
+"""Chunked, resumable CSV import jobs.
+
+An :class:`~investor_api.models.ImportJob` goes through three phases: loans,
+cash flows and metrics. Each chunk is written in its own transaction together
+with the job's checkpoint, so after a worker crash the job resumes from the
+last committed chunk. Invalid rows are recorded on the job and skipped
+instead of failing the whole import.
+
+In upsert mode existing loans and cash flows are updated rather than
+rejected or duplicated. Every row stores a hash of its CSV values, so rows
+unchanged since the last import are skipped before they are even validated,
+and only the loans that changed get their metrics recalculated.
+
+A job can also be split by loan identifier hash into shards, child jobs that
+own disjoint sets of loans and so can run on several workers at once. Shards
+leave the portfolio aggregate and the cache alone; both are refreshed once,
+after the last shard.
+"""
+import csv
+import hashlib
+import zlib
+from collections import defaultdict
+from itertools import islice
+from operator import itemgetter
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .caching import (
+    CASH_FLOW_NAMESPACES,
+    LOAN_NAMESPACES,
+    deferred_invalidation,
+    invalidate,
+)
+from .metrics import timed_phase
+from .models import (
+    CashFlow,
+    ImportJob,
+    Loan,
+    PortfolioAggregate,
+    invalidate_cached_objects,
+)
+from .services import recalculate_loan_metrics
+from .staging import StagedFileWriter, discard_staged, open_staged, verify_staged
+
+
+IMPORT_BATCH_SIZE = 1000
+
+LOAN_COLUMNS = [
+    "identifier",
+    "issue_date",
+    "total_amount",
+    "rating",
+    "maturity_date",
+    "total_expected_interest_amount",
+]
+CASH_FLOW_COLUMNS = ["reference_date", "type", "amount"]
+CASH_FLOW_HASH_COLUMNS = ["loan_identifier"] + CASH_FLOW_COLUMNS
+
+# Prepended to shard files so row errors point at the row of the uploaded file.
+SOURCE_ROW_COLUMN = "source_row"
+# Set on cash flow rows of upserts, see cash_flow_key.
+OCCURRENCE_COLUMN = "_occurrence"
+
+
+def batched(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _row_error(file_name, row_number, errors):
+    return {"file": file_name, "row": row_number, "errors": errors}
+
+
+def clean_loan_row(row):
+    loan = Loan(**{column: row.get(column) for column in LOAN_COLUMNS})
+    loan.full_clean(validate_unique=False)
+    return loan
+
+
+def clean_cash_flow_row(row):
+    cash_flow = CashFlow(**{column: row.get(column) for column in CASH_FLOW_COLUMNS})
+    cash_flow.full_clean(exclude=["loan_identifier"], validate_unique=False)
+    return cash_flow
+
+
+def row_hash(row, columns):
+    """Hash of the raw values of ``columns``, to skip rows that did not change."""
+    content = "\x1f".join(row.get(column) or "" for column in columns)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _parse_date(value):
+    try:
+        return parse_date(value or "")
+    except ValueError:
+        return None
+
+
+def cash_flow_key(row):
+    """The natural key upserts match cash flow rows on.
+
+    Several cash flows can share it, like two repayments on the same day, so
+    the n-th row of the file with a key is matched with the n-th cash flow
+    with that key, in the order they were created.
+    """
+    return (
+        row.get("loan_identifier"),
+        _parse_date(row.get("reference_date")),
+        row.get("type"),
+    )
+
+
+def _number_occurrences(rows, key):
+    """Store in every row how many rows before it share its ``key``."""
+    seen = defaultdict(int)
+    for row_number, row in rows:
+        row_key = key(row)
+        row[OCCURRENCE_COLUMN] = seen[row_key]
+        seen[row_key] += 1
+        yield row_number, row
+
+
+def import_loan_chunk(rows, upsert=False):
+    """Write the valid loans of ``rows``.
+
+    Returns the errors of the other rows and the number of unchanged rows.
+    An existing loan is an error, or in upsert mode it is updated unless its
+    row has not changed since the last import.
+    """
+    existing = {
+        identifier: (pk, source_hash)
+        for identifier, pk, source_hash in Loan.objects.filter(
+            identifier__in=[row.get("identifier") for _, row in rows]
+        ).values_list("identifier", "pk", "source_hash")
+    }
+    new_loans = {}
+    changed_loans = {}
+    errors = []
+    unchanged = 0
+    for row_number, row in rows:
+        identifier = row.get("identifier")
+        source_hash = row_hash(row, LOAN_COLUMNS)
+        current = existing.get(identifier)
+        if current is not None and not upsert:
+            errors.append(
+                _row_error(
+                    "loans.csv",
+                    row_number,
+                    {"identifier": ["Loan with this identifier already exists."]},
+                )
+            )
+            continue
+        if current is not None and current[1] == source_hash:
+            unchanged += 1
+            continue
+
+        try:
+            loan = clean_loan_row(row)
+        except ValidationError as error:
+            errors.append(_row_error("loans.csv", row_number, error.message_dict))
+            continue
+        loan.source_hash = source_hash
+        loan.metrics_stale = True
+        if current is not None:
+            loan.pk = current[0]
+            changed_loans[identifier] = loan
+        else:
+            new_loans[identifier] = loan
+            if not upsert:
+                existing[identifier] = (None, source_hash)
+
+    Loan.objects.bulk_create(new_loans.values())
+    Loan.objects.bulk_update(
+        changed_loans.values(), LOAN_COLUMNS[1:] + ["source_hash", "metrics_stale"]
+    )
+    PortfolioAggregate.apply_delta({"loan_count": len(new_loans)})
+    invalidate_cached_objects(loans=changed_loans.values())
+    return errors, unchanged
+
+
+def import_cash_flow_chunk(rows, upsert=False):
+    """Write the valid cash flows of ``rows``.
+
+    Returns the errors of the other rows and the number of unchanged rows.
+    In upsert mode a cash flow with the same :func:`cash_flow_key` is updated
+    instead of added, unless its row has not changed. Rows are matched by the
+    occurrence numbered by ``_import_rows``, or else within the chunk.
+    """
+    loans = Loan.objects.in_bulk(
+        {row.get("loan_identifier") for _, row in rows} - {None, ""},
+        field_name="identifier",
+    )
+    existing = defaultdict(list)
+    if upsert:
+        for pk, identifier, reference_date, cash_flow_type, amount, source_hash in (
+            CashFlow.objects.filter(loan_identifier__in=list(loans))
+            .order_by("pk")
+            .values_list(
+                "pk", "loan_identifier", "reference_date", "type", "amount", "source_hash"
+            )
+        ):
+            existing[(identifier, reference_date, cash_flow_type)].append(
+                (pk, amount, source_hash)
+            )
+    occurrences = defaultdict(int)
+
+    new_cash_flows = {}
+    changed_cash_flows = {}
+    stale_loans = set()
+    errors = []
+    unchanged = 0
+    for row_number, row in rows:
+        identifier = row.get("loan_identifier")
+        source_hash = row_hash(row, CASH_FLOW_HASH_COLUMNS)
+        current = None
+        if upsert:
+            key = cash_flow_key(row)
+            occurrence = row.get(OCCURRENCE_COLUMN)
+            if occurrence is None:
+                occurrence = occurrences[key]
+                occurrences[key] += 1
+            matches = existing.get(key, ())
+            if occurrence < len(matches):
+                current = matches[occurrence]
+            if current is not None and current[2] == source_hash:
+                unchanged += 1
+                continue
+
+        try:
+            cash_flow = clean_cash_flow_row(row)
+        except ValidationError as error:
+            errors.append(_row_error("cash_flow.csv", row_number, error.message_dict))
+            continue
+        if identifier not in loans:
+            errors.append(
+                _row_error(
+                    "cash_flow.csv",
+                    row_number,
+                    {"loan_identifier": ["Loan %r does not exist." % identifier]},
+                )
+            )
+            continue
+        cash_flow.loan_identifier = loans[identifier]
+        cash_flow.source_hash = source_hash
+        stale_loans.add(identifier)
+        if current is not None:
+            cash_flow.pk = current[0]
+            changed_cash_flows[row_number] = (cash_flow, current[1])
+        else:
+            new_cash_flows[row_number] = cash_flow
+
+    CashFlow.objects.bulk_create(new_cash_flows.values())
+    CashFlow.objects.bulk_update(
+        [cash_flow for cash_flow, _ in changed_cash_flows.values()],
+        ["amount", "source_hash"],
+    )
+    repayments = defaultdict(lambda: [0, 0])
+    for cash_flow in new_cash_flows.values():
+        if cash_flow.type == "Repayment":
+            repayments[cash_flow.loan_identifier_id][0] += cash_flow.amount
+            repayments[cash_flow.loan_identifier_id][1] += 1
+    for cash_flow, previous_amount in changed_cash_flows.values():
+        if cash_flow.type == "Repayment":
+            repayments[cash_flow.loan_identifier_id][0] += (
+                cash_flow.amount - previous_amount
+            )
+    Loan.apply_repayment_deltas(repayments)
+    Loan.objects.filter(identifier__in=stale_loans).update(metrics_stale=True)
+    invalidate_cached_objects(
+        cash_flows=[cash_flow for cash_flow, _ in changed_cash_flows.values()]
+        + list(new_cash_flows.values())
+    )
+    PortfolioAggregate.apply_delta(
+        {
+            "total_repaid_amount": sum(
+                cash_flow.amount
+                for cash_flow in new_cash_flows.values()
+                if cash_flow.type == "Repayment"
+            )
+            + sum(
+                cash_flow.amount - previous_amount
+                for cash_flow, previous_amount in changed_cash_flows.values()
+                if cash_flow.type == "Repayment"
+            )
+        }
+    )
+    return errors, unchanged
+
+
+def _import_rows(job, reference, counter, import_chunk, batch_size, key=None):
+    with open_staged(reference) as staged:
+        rows = (
+            (int(row.pop(SOURCE_ROW_COLUMN, number)), row)
+            for number, row in enumerate(csv.DictReader(staged), start=1)
+        )
+        if key is not None and job.mode == ImportJob.UPSERT:
+            # Numbered from the start of the file, also when resuming.
+            rows = _number_occurrences(rows, key)
+        for chunk in batched(islice(rows, getattr(job, counter), None), batch_size):
+            with transaction.atomic():
+                errors, unchanged = import_chunk(chunk, job.mode == ImportJob.UPSERT)
+                setattr(job, counter, getattr(job, counter) + len(chunk))
+                job.rows_unchanged += unchanged
+                job.record_errors(sorted(errors, key=itemgetter("row")))
+                job.save(
+                    update_fields=[
+                        counter,
+                        "rows_unchanged",
+                        "error_count",
+                        "errors",
+                        "updated_at",
+                    ]
+                )
+
+
+def touched_loan_identifiers(job):
+    """Identifiers of every loan the job's files mention.
+
+    Only those the import marked ``metrics_stale`` are recalculated.
+    """
+    identifiers = set()
+    with open_staged(job.loan_csv) as staged:
+        identifiers.update(row.get("identifier") for row in csv.DictReader(staged))
+    with open_staged(job.cash_flow_csv) as staged:
+        identifiers.update(row.get("loan_identifier") for row in csv.DictReader(staged))
+    identifiers.discard(None)
+    identifiers.discard("")
+    return sorted(identifiers)
+
+
+def _recalculate_metrics(job, batch_size):
+    identifiers = touched_loan_identifiers(job)
+    for chunk in batched(identifiers[job.loans_recalculated:], batch_size):
+        with transaction.atomic():
+            recalculate_loan_metrics(
+                list(
+                    Loan.objects.filter(
+                        identifier__in=chunk, metrics_stale=True
+                    ).order_by("pk")
+                ),
+                batch_size,
+            )
+            job.loans_recalculated += len(chunk)
+            job.save(update_fields=["loans_recalculated", "updated_at"])
+
+
+def _set_phase(job, phase):
+    job.phase = phase
+    job.save(update_fields=["phase", "updated_at"])
+
+
+def _start(job):
+    job.status = ImportJob.RUNNING
+    job.message = ""
+    job.started_at = job.started_at or timezone.now()
+    job.finished_at = None
+    job.save(
+        update_fields=["status", "message", "started_at", "finished_at", "updated_at"]
+    )
+
+
+def _fail(job, message):
+    job.status = ImportJob.FAILED
+    job.message = message
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "message", "finished_at", "updated_at"])
+
+
+def run_import(job, batch_size=IMPORT_BATCH_SIZE):
+    """Run ``job`` from its last checkpoint to the end."""
+    if job.status == ImportJob.SUCCEEDED:
+        return job
+
+    sharded = job.parent_id is not None
+    _start(job)
+    try:
+        verify_staged(job.loan_csv)
+        verify_staged(job.cash_flow_csv)
+
+        with deferred_invalidation(apply=not sharded):
+            if sharded:
+                with PortfolioAggregate.suspended():
+                    _run_phases(job, batch_size)
+            else:
+                _run_phases(job, batch_size)
+                # bulk_create does not send post_save, so invalidate explicitly.
+                invalidate(*LOAN_NAMESPACES, *CASH_FLOW_NAMESPACES)
+    except Exception as error:
+        _fail(job, str(error))
+        raise
+
+    job.status = ImportJob.SUCCEEDED
+    job.phase = ImportJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "phase", "finished_at", "updated_at"])
+    discard_staged(job.loan_csv, job.cash_flow_csv)
+    return job
+
+
+def _run_phases(job, batch_size):
+    task = "import_shard" if job.parent_id else "import_job"
+    if job.phase == ImportJob.LOANS:
+        with timed_phase(task, ImportJob.LOANS):
+            _import_rows(
+                job, job.loan_csv, "loan_rows_processed", import_loan_chunk, batch_size
+            )
+        _set_phase(job, ImportJob.CASH_FLOWS)
+    if job.phase == ImportJob.CASH_FLOWS:
+        with timed_phase(task, ImportJob.CASH_FLOWS):
+            _import_rows(
+                job,
+                job.cash_flow_csv,
+                "cash_flow_rows_processed",
+                import_cash_flow_chunk,
+                batch_size,
+                key=cash_flow_key,
+            )
+        _set_phase(job, ImportJob.METRICS)
+    if job.phase == ImportJob.METRICS:
+        with timed_phase(task, ImportJob.METRICS):
+            _recalculate_metrics(job, batch_size)
+
+
+def shard_of(identifier, shard_count):
+    # crc32 rather than hash(), which differs between worker processes.
+    return zlib.crc32(identifier.encode("utf-8")) % shard_count
+
+
+def _split_file(reference, identifier_column, shard_count):
+    writers = [StagedFileWriter() for _ in range(shard_count)]
+    try:
+        with open_staged(reference) as staged:
+            reader = csv.reader(staged)
+            header = next(reader, [])
+            column = header.index(identifier_column) if identifier_column in header else -1
+            csv_writers = [csv.writer(writer) for writer in writers]
+            for csv_writer in csv_writers:
+                csv_writer.writerow([SOURCE_ROW_COLUMN] + header)
+
+            number = 0
+            for row in reader:
+                # csv.DictReader skips blank lines too, keep the same numbering.
+                if not row:
+                    continue
+                number += 1
+                identifier = row[column] if 0 <= column < len(row) else ""
+                csv_writers[shard_of(identifier, shard_count)].writerow([number] + row)
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+    return [writer.close() for writer in writers]
+
+
+def split_import(job, shard_count):
+    """Split ``job`` into ``shard_count`` child jobs by loan identifier hash."""
+    if job.shard_count:
+        _start(job)
+        return list(job.shards.order_by("shard"))
+
+    _start(job)
+    references = []
+    try:
+        verify_staged(job.loan_csv)
+        verify_staged(job.cash_flow_csv)
+        loan_csvs = _split_file(job.loan_csv, "identifier", shard_count)
+        references.extend(loan_csvs)
+        cash_flow_csvs = _split_file(job.cash_flow_csv, "loan_identifier", shard_count)
+        references.extend(cash_flow_csvs)
+
+        with transaction.atomic():
+            shards = [
+                ImportJob.objects.create(
+                    parent=job,
+                    shard=shard,
+                    loan_csv=loan_csvs[shard],
+                    cash_flow_csv=cash_flow_csvs[shard],
+                    mode=job.mode,
+                    created_by=job.created_by,
+                )
+                for shard in range(shard_count)
+            ]
+            job.shard_count = shard_count
+            job.phase = ImportJob.SHARDS
+            job.save(update_fields=["shard_count", "phase", "updated_at"])
+    except Exception as error:
+        discard_staged(*references)
+        _fail(job, str(error))
+        raise
+    return shards
+
+
+def _refresh_after_shards():
+    with transaction.atomic():
+        PortfolioAggregate.rebuild()
+        invalidate(*LOAN_NAMESPACES, *CASH_FLOW_NAMESPACES)
+
+
+def finish_sharded_import(job):
+    """Refresh the aggregate and the cache once every shard has succeeded."""
+    _refresh_after_shards()
+    job.collect_shard_progress()
+    job.status = ImportJob.SUCCEEDED
+    job.phase = ImportJob.DONE
+    job.finished_at = timezone.now()
+    job.save()
+    discard_staged(job.loan_csv, job.cash_flow_csv)
+    return job
+
+
+def abort_sharded_import(job, shard, error):
+    """Fail ``job`` after ``shard`` failed; what the shards committed stays."""
+    _refresh_after_shards()
+    _fail(job, "Shard %s failed: %s" % (shard.shard, error))
+
+
+def shard_finished(shard):
+    """Refresh after a shard that finishes once its sharded job has failed.
+
+    The job's callback never runs then, so nothing else would count it.
+    """
+    if ImportJob.objects.filter(pk=shard.parent_id, status=ImportJob.FAILED).exists():
+        _refresh_after_shards()
@@ -0,0 +1,48 @@
+"""Measure what a process pays in imports to start the app.
+
+Every web and Celery worker runs ``django.setup()`` and loads the URLconf
+before serving anything; this runs the same in a fresh interpreter under
+``python -X importtime`` and parses its report.
+"""
+import os
+import subprocess
+import sys
+from django.conf import settings
+
+
+STARTUP_SCRIPT = """
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+
+def measure_import_time():
+    """Return ``{module: (self_us, cumulative_us)}`` for a fresh app startup."""
+    env = dict(os.environ)
+    env.setdefault("DJANGO_SETTINGS_MODULE", "application.settings")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # The header line.
+            continue
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def total_import_time(modules):
+    """Seconds spent importing ``modules``."""
+    return sum(self_us for self_us, _ in modules.values()) / 1000000
@@ -0,0 +1,140 @@
+"""Vectorized XIRR for many loans at once.
+
+Cash flows of every loan are packed into flat NumPy arrays (one entry per
+cash flow) plus an ``offsets`` array holding the index of the first cash
+flow of each loan, so thousands of loans are solved in a handful of array
+operations instead of one ``pyxirr.xirr`` call per loan.
+"""
+from datetime import date
+import numpy as np
+from pyxirr import InvalidPaymentsError, xirr
+
+
+DAYS_IN_YEAR = 365.0
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-12
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def as_days(dates):
+    """Convert dates (``date``, ISO strings, datetime64 or day numbers) to day numbers."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def day_number(value):
+    if isinstance(value, date):
+        return value.toordinal() - EPOCH_ORDINAL
+    return int(as_days(value))
+
+
+def pack_cash_flows(groups):
+    """Pack ``[[(date, amount), ...], ...]`` into ``(dates, amounts, offsets)``."""
+    days = []
+    amounts = []
+    offsets = np.empty(len(groups), dtype=np.int64)
+    for index, group in enumerate(groups):
+        offsets[index] = len(amounts)
+        for reference_date, amount in group:
+            days.append(day_number(reference_date))
+            amounts.append(amount)
+    return (
+        np.asarray(days, dtype=np.int64),
+        np.asarray(amounts, dtype=np.float64),
+        offsets,
+    )
+
+
+def bullet_irr(first_amounts, second_amounts, days):
+    """Closed-form XIRR of two cash flows ``days`` apart.
+
+    With one funding and one repayment the XIRR equation has the exact
+    solution ``(repayment / -funding) ** (365 / days) - 1``. Pairs without a
+    sign change or with both cash flows on the same day give ``nan``.
+    """
+    first_amounts = np.asarray(first_amounts, dtype=np.float64)
+    second_amounts = np.asarray(second_amounts, dtype=np.float64)
+    days = np.asarray(days, dtype=np.float64)
+
+    with np.errstate(all="ignore"):
+        ratio = -second_amounts / first_amounts
+        irr = np.power(ratio, DAYS_IN_YEAR / days) - 1
+    return np.where((ratio > 0) & (days != 0) & np.isfinite(irr), irr, np.nan)
+
+
+def batch_xirr(dates, amounts, offsets, guess=0.1):
+    """Solve XIRR for every loan packed in ``dates``/``amounts``/``offsets``.
+
+    Returns one rate per loan, or ``nan`` where no solution exists.
+    Two-cash-flow loans use :func:`bullet_irr`; the rest are solved together
+    with Newton's method, falling back to ``pyxirr`` for loans that fail to
+    converge.
+    """
+    days = as_days(dates)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    loan_count = len(offsets)
+    result = np.full(loan_count, np.nan)
+    if loan_count == 0 or len(amounts) == 0:
+        return result
+
+    counts = np.diff(np.append(offsets, len(amounts)))
+    group = np.repeat(np.arange(loan_count), counts)
+
+    has_positive = np.bincount(group, weights=amounts > 0, minlength=loan_count) > 0
+    has_negative = np.bincount(group, weights=amounts < 0, minlength=loan_count) > 0
+    solvable = has_positive & has_negative
+
+    bullet = solvable & (counts == 2)
+    first = offsets[bullet]
+    result[bullet] = bullet_irr(
+        amounts[first], amounts[first + 1], days[first + 1] - days[first]
+    )
+
+    pending = solvable & ~bullet
+    if not pending.any():
+        return result
+
+    start = np.full(loan_count, np.iinfo(np.int64).max)
+    np.minimum.at(start, group, days)
+    years = (days - start[group]) / DAYS_IN_YEAR
+
+    rate = np.full(loan_count, float(guess))
+    active = pending.copy()
+    with np.errstate(all="ignore"):
+        for _ in range(MAX_ITERATIONS):
+            rows = active[group]
+            row_group = group[rows]
+            row_years = years[rows]
+            base = 1.0 + rate[row_group]
+            discounted = amounts[rows] * np.power(base, -row_years)
+            npv = np.bincount(row_group, weights=discounted, minlength=loan_count)
+            derivative = np.bincount(
+                row_group, weights=-row_years * discounted / base, minlength=loan_count
+            )
+            next_rate = rate - npv / derivative
+            # Keep 1 + rate positive by halving the distance to -1 instead.
+            next_rate = np.where(next_rate <= -1.0, (rate - 1.0) / 2.0, next_rate)
+
+            converged = active & (np.abs(next_rate - rate) < TOLERANCE)
+            rate = np.where(active, next_rate, rate)
+            active &= ~converged & np.isfinite(rate)
+            if not active.any():
+                break
+
+    solved = pending & ~active & np.isfinite(rate)
+    result[solved] = rate[solved]
+
+    for index in np.flatnonzero(pending & ~solved):
+        lower = offsets[index]
+        upper = lower + counts[index]
+        try:
+            value = xirr(
+                days[lower:upper].astype("datetime64[D]").tolist(),
+                amounts[lower:upper].tolist(),
+            )
+        except InvalidPaymentsError:
+            value = None
+        result[index] = np.nan if value is None else value
+
+    return result
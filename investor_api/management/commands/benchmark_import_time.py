@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from investor_api.importtime import measure_import_time, total_import_time
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the imports of django.setup() and URL loading in a fresh "
+        "interpreter, with python -X importtime, and list the slowest modules."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        runs = [measure_import_time() for _ in range(options["repeat"])]
+        modules = min(runs, key=total_import_time)
+
+        self.stdout.write(
+            "%s modules imported in %.3fs (best of %s)"
+            % (len(modules), total_import_time(modules), options["repeat"])
+        )
+        slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative_us) in slowest[: options["top"]]:
+            self.stdout.write(
+                "%8.1fms %8.1fms  %s" % (cumulative_us / 1000, self_us / 1000, name)
+            )
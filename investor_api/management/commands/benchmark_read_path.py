@@ -0,0 +1,103 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from investor_api.exports import loan_rows, stream_json_array
+from investor_api.models import CashFlow, Loan
+from investor_api.serializers import LoanDetailSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rendering every loan with LoanDetailSerializer against the "
+        "values()-based export path, on synthetic data that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loans", type=int, default=10000)
+        parser.add_argument("--cash-flows-per-loan", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_loans(options["loans"], options["cash_flows_per_loan"])
+            serializer_time, serializer_output = self.measure(
+                self.render_with_serializer, options["repeat"]
+            )
+            export_time, export_output = self.measure(
+                self.render_with_export, options["repeat"]
+            )
+            transaction.set_rollback(True)
+
+        if serializer_output != export_output:
+            raise CommandError("Both paths must render the same bytes.")
+
+        self.stdout.write(
+            "%s loans, %s bytes\n"
+            "serializer: %.3fs\n"
+            "export:     %.3fs (%.1fx faster)"
+            % (
+                options["loans"],
+                len(export_output),
+                serializer_time,
+                export_time,
+                serializer_time / export_time,
+            )
+        )
+
+    def create_loans(self, loan_count, cash_flows_per_loan):
+        issue_date = date(2021, 1, 1)
+        loans = [
+            Loan(
+                identifier="BENCH%07d" % number,
+                issue_date=issue_date,
+                total_amount=100000,
+                rating=number % 9 + 1,
+                maturity_date=issue_date + timedelta(days=365),
+                total_expected_interest_amount=12000,
+                investment_date=issue_date,
+                invested_amount=100000,
+                expected_interest_amount=12000,
+                expected_irr=0.12,
+            )
+            for number in range(loan_count)
+        ]
+        Loan.objects.bulk_create(loans, batch_size=1000)
+
+        cash_flows = []
+        for loan in loans:
+            cash_flows.append(
+                CashFlow(
+                    loan_identifier=loan,
+                    reference_date=issue_date,
+                    type="Funding",
+                    amount=-100000,
+                )
+            )
+            for month in range(1, cash_flows_per_loan):
+                cash_flows.append(
+                    CashFlow(
+                        loan_identifier=loan,
+                        reference_date=issue_date + timedelta(days=30 * month),
+                        type="Repayment",
+                        amount=112000 / (cash_flows_per_loan - 1),
+                    )
+                )
+        CashFlow.objects.bulk_create(cash_flows, batch_size=1000)
+
+    def measure(self, render, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def render_with_serializer(self):
+        queryset = Loan.objects.order_by("pk").prefetch_related("cash_flows")
+        return JSONRenderer().render(LoanDetailSerializer(queryset, many=True).data)
+
+    def render_with_export(self):
+        return b"".join(stream_json_array(loan_rows(Loan.objects.order_by("pk"))))
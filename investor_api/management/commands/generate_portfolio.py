@@ -0,0 +1,85 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from investor_api.synthetic import (
+    DEFAULT_AS_OF,
+    DEFAULT_PATTERN_MIX,
+    DEFAULT_RATING_MIX,
+    MAX_LOANS,
+    PortfolioGenerator,
+)
+
+
+def parse_mix(value, convert_key=str):
+    """Parse ``"key=weight,..."`` into a dict of weights."""
+    mix = {}
+    for item in value.split(","):
+        key, _, weight = item.partition("=")
+        try:
+            mix[convert_key(key.strip())] = float(weight)
+        except ValueError:
+            raise CommandError("Invalid mix entry %r, expected key=weight." % item)
+    return mix
+
+
+def format_mix(mix):
+    return ",".join("%s=%s" % item for item in mix.items())
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a synthetic portfolio as loans.csv and cash_flows.csv, in the "
+        "format accepted by /csv/upload/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loans", type=int, default=10000, help="Up to %s." % MAX_LOANS
+        )
+        parser.add_argument(
+            "--rating-mix",
+            default=format_mix(DEFAULT_RATING_MIX),
+            help="Relative weight of each rating.",
+        )
+        parser.add_argument(
+            "--pattern-mix",
+            default=format_mix(DEFAULT_PATTERN_MIX),
+            help="Relative weight of each repayment pattern: %s."
+            % ", ".join(DEFAULT_PATTERN_MIX),
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--as-of",
+            default=DEFAULT_AS_OF.isoformat(),
+            help="Cash flows after this date are left out.",
+        )
+        parser.add_argument("--output-dir", default=".")
+
+    def handle(self, *args, **options):
+        as_of = parse_date(options["as_of"])
+        if as_of is None:
+            raise CommandError("--as-of must be a date in YYYY-MM-DD format.")
+        try:
+            generator = PortfolioGenerator(
+                options["loans"],
+                rating_mix=parse_mix(options["rating_mix"], int),
+                pattern_mix=parse_mix(options["pattern_mix"]),
+                seed=options["seed"],
+                as_of=as_of,
+            )
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        output_dir = Path(options["output_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        loan_path = output_dir / "loans.csv"
+        cash_flow_path = output_dir / "cash_flows.csv"
+        with open(loan_path, "w", newline="") as loan_file, open(
+            cash_flow_path, "w", newline=""
+        ) as cash_flow_file:
+            loans, cash_flows = generator.write_csv(loan_file, cash_flow_file)
+
+        self.stdout.write(
+            "Wrote %s loans to %s and %s cash flows to %s."
+            % (loans, loan_path, cash_flows, cash_flow_path)
+        )
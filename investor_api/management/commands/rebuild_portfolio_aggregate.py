@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from investor_api.caching import STATISTICS, invalidate
+from investor_api.models import PortfolioAggregate
+
+
+class Command(BaseCommand):
+    help = "Recompute the portfolio aggregate from the Loan and CashFlow tables."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            aggregate = PortfolioAggregate.rebuild()
+            invalidate(STATISTICS)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Portfolio aggregate rebuilt: %s loans, %s invested, %s repaid."
+                % (
+                    aggregate.loan_count,
+                    aggregate.total_invested_amount,
+                    aggregate.total_repaid_amount,
+                )
+            )
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from investor_api.models import Loan
+
+
+class Command(BaseCommand):
+    help = "Rebuild Loan.repaid_amount and Loan.repayment_count from the CashFlow table."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Loan.rebuild_repayment_totals()
+
+        self.stdout.write(
+            self.style.SUCCESS("Repayment totals rebuilt for %s loans." % updated)
+        )
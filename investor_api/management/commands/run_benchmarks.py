@@ -0,0 +1,205 @@
+import json
+import platform
+import time
+import tracemalloc
+from io import StringIO
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from investor_api.charts import render_charts
+from investor_api.imports import run_import
+from investor_api.models import CustomUser, ImportJob, Loan
+from investor_api.services import recalculate_loan_metrics
+from investor_api.staging import stage_upload
+from investor_api.synthetic import PortfolioGenerator
+from investor_api.views import CashFlowList, InvestmentStatisticsView, LoanList
+
+
+BENCHMARKS = [
+    "import_job",
+    "recalculate_metrics",
+    "statistics",
+    "statistics_charts",
+    "loan_list",
+    "cash_flow_list",
+]
+
+# Measure the work behind every response, not the cache in front of it.
+UNCACHED = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the import, the metrics recalculation, the statistics and the list "
+        "endpoints on synthetic portfolios of several sizes, and write the wall "
+        "time, query count and peak memory of each as JSON. Every portfolio is "
+        "rolled back, and the database must not contain loans already."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="100,1000,10000",
+            help="Comma-separated loan counts.",
+        )
+        parser.add_argument(
+            "--benchmarks",
+            default=",".join(BENCHMARKS),
+            help="Comma-separated subset of: %s." % ", ".join(BENCHMARKS),
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--label", default="", help="Stored with the results, e.g. a release."
+        )
+        parser.add_argument("--output", default="benchmark-results.json")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated loan counts.")
+        benchmarks = options["benchmarks"].split(",")
+        unknown = set(benchmarks) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError("Unknown benchmarks: %s." % ", ".join(sorted(unknown)))
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        if Loan.objects.exists():
+            raise CommandError("Run the benchmarks against an empty database.")
+
+        report = {
+            "label": options["label"],
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "seed": options["seed"],
+            "repeat": options["repeat"],
+            "results": [],
+        }
+        with override_settings(
+            CACHES=UNCACHED,
+            METRICS_ENABLED=False,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        ):
+            for size in sizes:
+                with transaction.atomic():
+                    report["results"].append(
+                        self.run_size(size, benchmarks, options)
+                    )
+                    transaction.set_rollback(True)
+
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write("Results written to %s." % options["output"])
+
+    def run_size(self, size, benchmarks, options):
+        try:
+            generator = PortfolioGenerator(size, seed=options["seed"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        loan_csv, cash_flow_csv = StringIO(), StringIO()
+        loans, cash_flows = generator.write_csv(loan_csv, cash_flow_csv)
+        loan_csv, cash_flow_csv = loan_csv.getvalue(), cash_flow_csv.getvalue()
+
+        def create_import_job():
+            # Staged untimed: the upload view does this before queueing the job.
+            return ImportJob.objects.create(
+                loan_csv=stage_upload(ContentFile(loan_csv.encode(), "loans.csv")),
+                cash_flow_csv=stage_upload(
+                    ContentFile(cash_flow_csv.encode(), "cash_flow.csv")
+                ),
+            )
+
+        user = CustomUser(username="benchmark", is_staff=True)
+        factory = APIRequestFactory()
+
+        def get(view, path):
+            request = factory.get(path)
+            force_authenticate(request, user=user)
+            response = view.as_view()(request)
+            response.render()
+            if response.status_code != 200:
+                raise CommandError("%s returned %s." % (path, response.status_code))
+
+        cases = {
+            "import_job": run_import,
+            "recalculate_metrics": lambda: recalculate_loan_metrics(
+                Loan.objects.order_by("pk")
+            ),
+            "statistics": lambda: get(InvestmentStatisticsView, "/statistics/basic/"),
+            "statistics_charts": render_charts,
+            "loan_list": lambda: get(LoanList, "/loans/"),
+            "cash_flow_list": lambda: get(CashFlowList, "/cashflows/"),
+        }
+
+        result = {"loans": loans, "cash_flows": cash_flows, "benchmarks": {}}
+        if "import_job" not in benchmarks:
+            run_import(create_import_job())
+        for name in BENCHMARKS:
+            if name not in benchmarks:
+                continue
+            # The portfolio the other benchmarks read is the one imported here.
+            keep = name == "import_job"
+            result["benchmarks"][name] = self.measure(
+                cases[name],
+                1 if keep else options["repeat"],
+                keep,
+                setup=create_import_job if keep else None,
+            )
+            self.stdout.write(
+                "%s loans, %s: %.3fs"
+                % (size, name, result["benchmarks"][name]["seconds"])
+            )
+        return result
+
+    def measure(self, function, repeat, keep=False, setup=None):
+        """Run ``function`` once under tracemalloc for its query count and peak
+        memory, then ``repeat`` more times for its best wall time.
+
+        ``setup`` runs untimed before every run and its result is passed to
+        ``function``. Every run is rolled back except, with ``keep``, the last one.
+        """
+        arguments = (lambda: (setup(),)) if setup else tuple
+        counter = QueryCounter()
+        with transaction.atomic():
+            args = arguments()
+            tracemalloc.start()
+            try:
+                with connection.execute_wrapper(counter):
+                    function(*args)
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            transaction.set_rollback(True)
+
+        timings = []
+        for run in range(repeat):
+            with transaction.atomic():
+                args = arguments()
+                started = time.perf_counter()
+                function(*args)
+                timings.append(time.perf_counter() - started)
+                if not (keep and run == repeat - 1):
+                    transaction.set_rollback(True)
+
+        return {
+            "seconds": min(timings),
+            "queries": counter.count,
+            "peak_memory_bytes": peak_memory,
+        }
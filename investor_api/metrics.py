@@ -0,0 +1,232 @@
+"""Prometheus histograms and counters shared by every web and worker process.
+
+Observations are added to Redis hashes, one per metric, so that
+``/metrics`` reports the totals of all gunicorn and Celery processes rather
+than those of the process that happens to serve the scrape. Recording a
+metric never fails the request or task being measured.
+"""
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+PHASE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    return ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _format_bound(bound):
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(bound) if isinstance(bound, float) else str(bound)
+
+
+class Counter:
+    """A Prometheus counter with ``label_names``.
+
+    Every label combination is stored as a field of one Redis hash.
+    """
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    @property
+    def key(self):
+        return cache.make_key("metrics:%s" % self.name)
+
+    def inc(self, amount=1, **labels):
+        get_redis_connection("default").hincrby(
+            self.key,
+            _format_labels((name, labels[name]) for name in self.label_names),
+            amount,
+        )
+
+    def expose(self, redis):
+        """Return the counter in the Prometheus text format."""
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s counter" % self.name,
+        ]
+        values = redis.hgetall(self.key)
+        for labels in sorted(values):
+            lines.append(
+                "%s{%s} %s"
+                % (self.name, labels.decode("utf-8"), values[labels].decode("utf-8"))
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        get_redis_connection("default").delete(self.key)
+
+
+class Histogram:
+    """A Prometheus histogram with fixed ``buckets`` and ``label_names``.
+
+    Every label combination is stored as fields of one Redis hash:
+    ``<labels>|<upper bound>`` for the cumulative bucket counts, and
+    ``<labels>|sum`` and ``<labels>|count``.
+    """
+
+    def __init__(self, name, documentation, buckets, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.label_names = tuple(label_names)
+
+    @property
+    def key(self):
+        return cache.make_key("metrics:%s" % self.name)
+
+    def _labels(self, labels):
+        return _format_labels((name, labels[name]) for name in self.label_names)
+
+    def observe(self, value, pipeline=None, **labels):
+        own_pipeline = pipeline is None
+        if own_pipeline:
+            pipeline = get_redis_connection("default").pipeline(transaction=False)
+
+        prefix = self._labels(labels)
+        for bound in self.buckets:
+            if value <= bound:
+                pipeline.hincrby(self.key, "%s|%s" % (prefix, _format_bound(bound)), 1)
+        pipeline.hincrbyfloat(self.key, "%s|sum" % prefix, value)
+        pipeline.hincrby(self.key, "%s|count" % prefix, 1)
+
+        if own_pipeline:
+            pipeline.execute()
+
+    def expose(self, redis):
+        """Return the histogram in the Prometheus text format."""
+        series = defaultdict(dict)
+        for field, value in redis.hgetall(self.key).items():
+            labels, _, suffix = field.decode("utf-8").rpartition("|")
+            series[labels][suffix] = value.decode("utf-8")
+
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s histogram" % self.name,
+        ]
+        for labels in sorted(series):
+            values = series[labels]
+            separator = "," if labels else ""
+            for bound in map(_format_bound, self.buckets):
+                lines.append(
+                    '%s_bucket{%s%sle="%s"} %s'
+                    % (self.name, labels, separator, bound, values.get(bound, 0))
+                )
+            for suffix in ("sum", "count"):
+                lines.append(
+                    "%s_%s%s %s"
+                    % (
+                        self.name,
+                        suffix,
+                        "{%s}" % labels if labels else "",
+                        values.get(suffix, 0),
+                    )
+                )
+        return "\n".join(lines)
+
+    def reset(self):
+        get_redis_connection("default").delete(self.key)
+
+
+REQUEST_DURATION = Histogram(
+    "investor_api_request_duration_seconds",
+    "Time spent handling a request.",
+    LATENCY_BUCKETS,
+    ["view", "method", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "investor_api_request_queries",
+    "Number of SQL queries run by a request.",
+    QUERY_COUNT_BUCKETS,
+    ["view", "method"],
+)
+REQUEST_SQL_DURATION = Histogram(
+    "investor_api_request_sql_duration_seconds",
+    "Time spent in SQL queries by a request.",
+    LATENCY_BUCKETS,
+    ["view", "method"],
+)
+CSV_IMPORT_PHASE_DURATION = Histogram(
+    "investor_api_csv_import_phase_duration_seconds",
+    "Time spent in each phase of a CSV import.",
+    PHASE_BUCKETS,
+    ["task", "phase"],
+)
+
+OBJECT_CACHE_REQUESTS = Counter(
+    "investor_api_object_cache_requests_total",
+    "Reads of single objects through the cache, by result.",
+    ["object", "result"],
+)
+
+HISTOGRAMS = [
+    REQUEST_DURATION,
+    REQUEST_QUERIES,
+    REQUEST_SQL_DURATION,
+    CSV_IMPORT_PHASE_DURATION,
+]
+COUNTERS = [OBJECT_CACHE_REQUESTS]
+
+
+def record_request(view, method, status, duration, queries, sql_duration):
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        REQUEST_DURATION.observe(
+            duration, pipeline, view=view, method=method, status=status
+        )
+        REQUEST_QUERIES.observe(queries, pipeline, view=view, method=method)
+        REQUEST_SQL_DURATION.observe(sql_duration, pipeline, view=view, method=method)
+        pipeline.execute()
+    except Exception:
+        logger.warning("Could not record the metrics of %s.", view, exc_info=True)
+
+
+@contextmanager
+def timed_phase(task, phase):
+    """Record how long the block takes as a phase of the CSV import ``task``."""
+    started = time.perf_counter()
+    yield
+    if not settings.METRICS_ENABLED:
+        return
+    try:
+        CSV_IMPORT_PHASE_DURATION.observe(
+            time.perf_counter() - started, task=task, phase=phase
+        )
+    except Exception:
+        logger.warning("Could not record the %s %s phase.", task, phase, exc_info=True)
+
+
+def count_object_cache(kind, hit):
+    if not settings.METRICS_ENABLED:
+        return
+    try:
+        OBJECT_CACHE_REQUESTS.inc(object=kind, result="hit" if hit else "miss")
+    except Exception:
+        logger.warning("Could not count a %s cache read.", kind, exc_info=True)
+
+
+def expose():
+    redis = get_redis_connection("default")
+    return (
+        "\n".join(metric.expose(redis) for metric in HISTOGRAMS + COUNTERS) + "\n"
+    )
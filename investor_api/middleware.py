@@ -0,0 +1,76 @@
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .metrics import record_request
+from .profiling import is_admin, profile_request, profile_requested
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts the queries run and the time they take."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """Record the latency, SQL query count and SQL time of every request.
+
+    They are added to the ``/metrics`` histograms, labelled by view, and
+    with ``METRICS_SERVER_TIMING`` also returned in a ``Server-Timing``
+    header. Queries run while a streamed response is sent are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED and not settings.METRICS_SERVER_TIMING:
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        if settings.METRICS_ENABLED:
+            record_request(
+                view,
+                request.method,
+                response.status_code,
+                duration,
+                timer.count,
+                timer.duration,
+            )
+        if settings.METRICS_SERVER_TIMING:
+            response["Server-Timing"] = (
+                'app;dur=%.1f, db;dur=%.1f;desc="%s queries"'
+                % (duration * 1000, timer.duration * 1000, timer.count)
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile the requests of admins that ask for it, see ``profiling``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if profile_requested(request) and is_admin(request):
+            return profile_request(self.get_response, request)
+        return self.get_response(request)
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.7 on 2026-10-18 07:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investor_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loan_count', models.IntegerField(default=0)),
+                ('total_invested_amount', models.FloatField(default=0)),
+                ('current_invested_amount', models.FloatField(default=0)),
+                ('total_repaid_amount', models.FloatField(default=0)),
+                ('closed_invested_amount', models.FloatField(default=0)),
+                ('closed_weighted_irr', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='cashflow',
+            name='loan_identifier',
+            field=models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cash_flows', to='investor_api.loan', to_field='identifier'),
+        ),
+        migrations.AddIndex(
+            model_name='cashflow',
+            index=models.Index(fields=['loan_identifier', 'type', 'reference_date'], name='cashflow_loan_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cashflow',
+            index=models.Index(fields=['reference_date'], name='cashflow_reference_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['is_closed'], name='loan_is_closed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['rating'], name='loan_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['maturity_date'], name='loan_maturity_date_idx'),
+        ),
+    ]
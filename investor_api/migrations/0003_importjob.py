@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investor_api', '0002_indexes_and_portfolio_aggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('phase', models.CharField(choices=[('loans', 'Loans'), ('cash_flows', 'Cash flows'), ('metrics', 'Metrics'), ('done', 'Done')], default='loans', max_length=20)),
+                ('loan_csv', models.JSONField()),
+                ('cash_flow_csv', models.JSONField()),
+                ('loan_rows_processed', models.IntegerField(default=0)),
+                ('cash_flow_rows_processed', models.IntegerField(default=0)),
+                ('loans_recalculated', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('errors', models.JSONField(default=list)),
+                ('message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investor_api', '0003_importjob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='importjob',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='investor_api.importjob'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='shard',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='shard_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='phase',
+            field=models.CharField(choices=[('loans', 'Loans'), ('cash_flows', 'Cash flows'), ('metrics', 'Metrics'), ('shards', 'Shards'), ('done', 'Done')], default='loans', max_length=20),
+        ),
+    ]
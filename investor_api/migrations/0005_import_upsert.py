@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investor_api', '0004_importjob_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashflow',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Create'), ('upsert', 'Upsert')], default='create', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='rows_unchanged',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='metrics_stale',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='source_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 06:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_repayment_totals(apps, schema_editor):
+    Loan = apps.get_model('investor_api', 'Loan')
+    CashFlow = apps.get_model('investor_api', 'CashFlow')
+    repayments = (
+        CashFlow.objects.filter(loan_identifier=OuterRef('identifier'), type='Repayment')
+        .order_by()
+        .values('loan_identifier')
+    )
+    Loan.objects.update(
+        repaid_amount=Coalesce(
+            Subquery(repayments.annotate(total=Sum('amount')).values('total')),
+            Value(0.0),
+        ),
+        repayment_count=Coalesce(
+            Subquery(repayments.annotate(count=Count('pk')).values('count')),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investor_api', '0005_import_upsert'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='repaid_amount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='repayment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_repayment_totals, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,33 @@
-from django.db import models
-from django.db.models.signals import post_save
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.core.cache import cache
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import AbstractUser, Permission, Group
+from .caching import (
+    CASH_FLOW_NAMESPACES,
+    CASH_FLOW_OBJECT,
+    LOAN_NAMESPACES,
+    LOAN_OBJECT,
+    invalidate,
+    invalidate_objects,
+)
+from .revocation import revoke_tokens
 
 
 class CustomUser(AbstractUser):
@@ -26,7 +50,66 @@ class CustomUser(AbstractUser):
         related_query_name='custom_user'
     )
 
-class Loan(models.Model):
+    # Copied into the JWTs issued to the user, see investor_api.authentication.
+    token_claim_fields = (
+        "is_active",
+        "is_staff",
+        "is_superuser",
+        "is_investor",
+        "is_analyst",
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if instance.get_deferred_fields() & set(cls.token_claim_fields):
+            instance._token_claims = None
+        else:
+            instance._token_claims = instance.token_claims()
+        return instance
+
+    def token_claims(self):
+        return {field: getattr(self, field) for field in self.token_claim_fields}
+
+
+def _revoke_tokens_on_commit(user_id):
+    # Tokens issued before the commit still carry the previous roles.
+    transaction.on_commit(lambda: revoke_tokens(user_id))
+
+
+@receiver(post_save, sender=CustomUser)
+def revoke_tokens_on_role_change(sender, instance, created, **kwargs):
+    claims = instance.token_claims()
+    if not created and getattr(instance, "_token_claims", None) != claims:
+        _revoke_tokens_on_commit(instance.pk)
+    instance._token_claims = claims
+
+
+@receiver(post_delete, sender=CustomUser)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    _revoke_tokens_on_commit(instance.pk)
+
+
+class PortfolioContributionMixin:
+    """Remember what a row contributed to the portfolio aggregate when loaded.
+
+    ``PortfolioAggregate.apply_changes`` diffs that snapshot against the
+    current values to get the delta of a write.
+    """
+
+    portfolio_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if instance.get_deferred_fields() & set(instance.portfolio_fields):
+            instance._portfolio_contribution = None
+        else:
+            instance._portfolio_contribution = instance.portfolio_contribution()
+        return instance
+
+
+class Loan(PortfolioContributionMixin, models.Model):
     identifier = models.CharField(max_length=256, unique=True)
     issue_date = models.DateField()
     total_amount = models.FloatField()
@@ -39,9 +122,121 @@ class Loan(models.Model):
     is_closed = models.BooleanField(default=False)
     expected_irr = models.FloatField(null=True, blank=True)
     realized_irr = models.FloatField(null=True, blank=True)
-    
+    # Hash of the CSV row the loan was last imported from.
+    source_hash = models.CharField(max_length=32, blank=True, default="")
+    # Set by imports when the metrics above must be recalculated.
+    metrics_stale = models.BooleanField(default=False)
+    # Sum and count of the Repayment cash flows, maintained with F() updates.
+    repaid_amount = models.FloatField(default=0)
+    repayment_count = models.IntegerField(default=0)
+
+    portfolio_fields = ("invested_amount", "is_closed", "realized_irr")
+
+    REPAYMENT_FIELDS = ["repaid_amount", "repayment_count"]
+    REPAYMENT_DELTA_BATCH_SIZE = 500
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["is_closed"], name="loan_is_closed_idx"),
+            models.Index(fields=["rating"], name="loan_rating_idx"),
+            models.Index(fields=["maturity_date"], name="loan_maturity_date_idx"),
+        ]
 
-class CashFlow(models.Model):
+    def portfolio_contribution(self):
+        invested_amount = float(self.invested_amount or 0)
+        contribution = {"loan_count": 1, "total_invested_amount": invested_amount}
+        if self.is_closed:
+            contribution["closed_invested_amount"] = invested_amount
+            if self.realized_irr is not None:
+                contribution["closed_weighted_irr"] = invested_amount * self.realized_irr
+        else:
+            contribution["current_invested_amount"] = invested_amount
+        return contribution
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # A full save of an existing loan must not write back repayment totals
+        # that were loaded before its latest cash flows. Deferred fields and
+        # re-inserting a deleted row are left to Django's own save.
+        if update_fields is None:
+            values = [
+                value for value in values if value[0].attname not in self.REPAYMENT_FIELDS
+            ]
+        return super()._do_update(
+            base_qs, using, pk_val, values, update_fields, forced_update
+        )
+
+    @classmethod
+    def apply_repayment_deltas(cls, deltas):
+        """Add ``{identifier: (amount, count)}`` to the loans' repayment totals."""
+        deltas = [
+            (identifier, amount, count)
+            for identifier, (amount, count) in deltas.items()
+            if amount or count
+        ]
+        for start in range(0, len(deltas), cls.REPAYMENT_DELTA_BATCH_SIZE):
+            batch = deltas[start : start + cls.REPAYMENT_DELTA_BATCH_SIZE]
+            cls.objects.filter(
+                identifier__in=[identifier for identifier, _, _ in batch]
+            ).update(
+                repaid_amount=F("repaid_amount") + Case(
+                    *[When(identifier=identifier, then=Value(float(amount)))
+                      for identifier, amount, _ in batch],
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                ),
+                repayment_count=F("repayment_count") + Case(
+                    *[When(identifier=identifier, then=Value(count))
+                      for identifier, _, count in batch],
+                    default=Value(0),
+                    output_field=models.IntegerField(),
+                ),
+            )
+
+    @classmethod
+    def rebuild_repayment_totals(cls):
+        """Recompute every loan's repayment totals from the CashFlow table."""
+        repayments = (
+            CashFlow.objects.filter(
+                loan_identifier=OuterRef("identifier"), type="Repayment"
+            )
+            .order_by()
+            .values("loan_identifier")
+        )
+        return cls.objects.update(
+            repaid_amount=Coalesce(
+                Subquery(repayments.annotate(total=Sum("amount")).values("total")),
+                Value(0.0),
+            ),
+            repayment_count=Coalesce(
+                Subquery(repayments.annotate(count=Count("pk")).values("count")),
+                Value(0),
+            ),
+        )
+
+    @classmethod
+    def apply_repayment_changes(cls, cash_flows, removed=False):
+        """Apply what ``cash_flows`` changed since they were loaded, or created."""
+        deltas = defaultdict(lambda: [0, 0])
+        for cash_flow in cash_flows:
+            previous = getattr(cash_flow, "_portfolio_contribution", {})
+            if removed:
+                current = {}
+                if not previous:
+                    previous = cash_flow.portfolio_contribution()
+            elif previous is None:
+                continue
+            else:
+                current = cash_flow.portfolio_contribution()
+
+            delta = deltas[cash_flow.loan_identifier_id]
+            for contribution, sign in ((current, 1), (previous, -1)):
+                if "total_repaid_amount" in contribution:
+                    delta[0] += sign * contribution["total_repaid_amount"]
+                    delta[1] += sign
+        cls.apply_repayment_deltas(deltas)
+
+
+class CashFlow(PortfolioContributionMixin, models.Model):
     reference_date = models.DateField()
     type = models.CharField(choices=[
         ('Funding', 'Funding'),
@@ -53,10 +248,301 @@ class CashFlow(models.Model):
                                         related_name='cash_flows',
                                         to_field='identifier',
                                         null=True, blank=True,
-                                        default=None)
+                                        default=None,
+                                        # Covered by cashflow_loan_type_date_idx.
+                                        db_index=False)
+    # Hash of the CSV row the cash flow was last imported from.
+    source_hash = models.CharField(max_length=32, blank=True, default="")
+
+    portfolio_fields = ("type", "amount")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["loan_identifier", "type", "reference_date"],
+                name="cashflow_loan_type_date_idx",
+            ),
+            models.Index(fields=["reference_date"], name="cashflow_reference_date_idx"),
+        ]
+
+    def portfolio_contribution(self):
+        if self.type == "Repayment":
+            return {"total_repaid_amount": float(self.amount)}
+        return {}
+
+
+_aggregate_state = threading.local()
+
+
+class PortfolioAggregate(models.Model):
+    """Portfolio-wide totals behind /statistics/basic/, kept as a single row.
+
+    Writes to loans and cash flows apply their deltas with ``F()`` updates in
+    the same transaction, so reading the statistics is O(1). The
+    ``rebuild_portfolio_aggregate`` command recomputes it from scratch.
+    """
+
+    SINGLETON_PK = 1
+
+    loan_count = models.IntegerField(default=0)
+    total_invested_amount = models.FloatField(default=0)
+    current_invested_amount = models.FloatField(default=0)
+    total_repaid_amount = models.FloatField(default=0)
+    closed_invested_amount = models.FloatField(default=0)
+    closed_weighted_irr = models.FloatField(default=0)
+
+    @property
+    def average_realized_irr(self):
+        if not self.closed_invested_amount:
+            return 0
+        return self.closed_weighted_irr / self.closed_invested_amount
+
+    @classmethod
+    def load(cls):
+        return cls.objects.filter(pk=cls.SINGLETON_PK).first() or cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        totals = Loan.objects.aggregate(
+            loan_count=Count("pk"),
+            total_invested_amount=Sum("invested_amount"),
+            current_invested_amount=Sum("invested_amount", filter=Q(is_closed=False)),
+            closed_invested_amount=Sum("invested_amount", filter=Q(is_closed=True)),
+            closed_weighted_irr=Sum(
+                F("invested_amount") * F("realized_irr"),
+                filter=Q(is_closed=True),
+                output_field=FloatField(),
+            ),
+        )
+        totals.update(
+            CashFlow.objects.filter(type="Repayment").aggregate(
+                total_repaid_amount=Sum("amount")
+            )
+        )
+        aggregate, _ = cls.objects.update_or_create(
+            pk=cls.SINGLETON_PK,
+            defaults={field: value or 0 for field, value in totals.items()},
+        )
+        return aggregate
+
+    @classmethod
+    @contextmanager
+    def suspended(cls):
+        """Skip every delta in the block; the caller must ``rebuild()`` after."""
+        previous = getattr(_aggregate_state, "suspended", False)
+        _aggregate_state.suspended = True
+        try:
+            yield
+        finally:
+            _aggregate_state.suspended = previous
+
+    @classmethod
+    def apply_delta(cls, delta):
+        if getattr(_aggregate_state, "suspended", False):
+            return
+        delta = {field: value for field, value in delta.items() if value}
+        if not delta:
+            return
+        updated = cls.objects.filter(pk=cls.SINGLETON_PK).update(
+            **{field: F(field) + value for field, value in delta.items()}
+        )
+        if not updated:
+            # The first write creates the row from the current tables, which
+            # already include this change.
+            cls.rebuild()
+
+    @classmethod
+    def apply_changes(cls, instances):
+        delta = defaultdict(int)
+        for instance in instances:
+            previous = getattr(instance, "_portfolio_contribution", {})
+            if previous is None:
+                continue
+            current = instance.portfolio_contribution()
+            for field in previous.keys() | current.keys():
+                delta[field] += current.get(field, 0) - previous.get(field, 0)
+            instance._portfolio_contribution = current
+        cls.apply_delta(delta)
+
+    @classmethod
+    def apply_removals(cls, instances):
+        delta = defaultdict(int)
+        for instance in instances:
+            previous = getattr(instance, "_portfolio_contribution", None)
+            if previous is None:
+                previous = instance.portfolio_contribution()
+            for field, value in previous.items():
+                delta[field] -= value
+        cls.apply_delta(delta)
+
+
+# Connected before update_portfolio_aggregate, which replaces the snapshot
+# that the repayment delta is computed against.
+@receiver(post_save, sender=CashFlow)
+def update_loan_repayments(sender, instance, **kwargs):
+    Loan.apply_repayment_changes([instance])
+
+
+@receiver(post_delete, sender=CashFlow)
+def remove_loan_repayments(sender, instance, **kwargs):
+    Loan.apply_repayment_changes([instance], removed=True)
 
 
 @receiver(post_save, sender=Loan)
 @receiver(post_save, sender=CashFlow)
-def invalidate_cache(sender, **kwargs):
-    cache.clear()
+def update_portfolio_aggregate(sender, instance, **kwargs):
+    PortfolioAggregate.apply_changes([instance])
+
+
+@receiver(post_delete, sender=Loan)
+@receiver(post_delete, sender=CashFlow)
+def remove_from_portfolio_aggregate(sender, instance, **kwargs):
+    PortfolioAggregate.apply_removals([instance])
+
+
+def invalidate_cached_objects(loans=(), cash_flows=()):
+    """Drop the cached payloads of ``loans``, ``cash_flows`` and their loans.
+
+    The loans of the cash flows are looked up with one query, unless they
+    were already fetched.
+    """
+    objects = {(LOAN_OBJECT, loan.pk) for loan in loans}
+    identifiers = set()
+    for cash_flow in cash_flows:
+        if cash_flow.pk is not None:
+            objects.add((CASH_FLOW_OBJECT, cash_flow.pk))
+        if CashFlow.loan_identifier.is_cached(cash_flow):
+            if cash_flow.loan_identifier is not None:
+                objects.add((LOAN_OBJECT, cash_flow.loan_identifier.pk))
+        elif cash_flow.loan_identifier_id is not None:
+            identifiers.add(cash_flow.loan_identifier_id)
+    if identifiers:
+        objects.update(
+            (LOAN_OBJECT, pk)
+            for pk in Loan.objects.filter(identifier__in=identifiers).values_list(
+                "pk", flat=True
+            )
+        )
+    invalidate_objects(*objects)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def invalidate_loan_cache(sender, instance, **kwargs):
+    invalidate(*LOAN_NAMESPACES)
+    invalidate_cached_objects(loans=[instance])
+
+
+@receiver(post_save, sender=CashFlow)
+@receiver(post_delete, sender=CashFlow)
+def invalidate_cash_flow_cache(sender, instance, **kwargs):
+    invalidate(*CASH_FLOW_NAMESPACES)
+    invalidate_cached_objects(cash_flows=[instance])
+
+
+
+class ImportJob(models.Model):
+    """Progress of a CSV import, checkpointed after every committed chunk.
+
+    The ``*_processed`` counters are the number of rows of each phase already
+    committed, so a job restarted after a worker crash resumes from there.
+    A sharded job only splits its files; each shard is a child job of its own.
+    """
+
+    CREATE = "create"
+    UPSERT = "upsert"
+    MODES = [CREATE, UPSERT]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    LOANS = "loans"
+    CASH_FLOWS = "cash_flows"
+    METRICS = "metrics"
+    SHARDS = "shards"
+    DONE = "done"
+
+    MAX_RECORDED_ERRORS = 1000
+
+    status = models.CharField(choices=[
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ], max_length=20, default=PENDING)
+    phase = models.CharField(choices=[
+        (LOANS, 'Loans'),
+        (CASH_FLOWS, 'Cash flows'),
+        (METRICS, 'Metrics'),
+        (SHARDS, 'Shards'),
+        (DONE, 'Done'),
+    ], max_length=20, default=LOANS)
+    mode = models.CharField(choices=[
+        (CREATE, 'Create'),
+        (UPSERT, 'Upsert'),
+    ], max_length=20, default=CREATE)
+    loan_csv = models.JSONField()
+    cash_flow_csv = models.JSONField()
+    parent = models.ForeignKey('self',
+                               on_delete=models.CASCADE,
+                               related_name='shards',
+                               null=True, blank=True)
+    shard = models.IntegerField(null=True, blank=True)
+    shard_count = models.IntegerField(default=0)
+    loan_rows_processed = models.IntegerField(default=0)
+    cash_flow_rows_processed = models.IntegerField(default=0)
+    rows_unchanged = models.IntegerField(default=0)
+    loans_recalculated = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list)
+    message = models.TextField(blank=True, default="")
+    created_by = models.ForeignKey(CustomUser,
+                                   on_delete=models.SET_NULL,
+                                   related_name='import_jobs',
+                                   null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def rows_processed(self):
+        return self.loan_rows_processed + self.cash_flow_rows_processed
+
+    @property
+    def rows_per_second(self):
+        if self.started_at is None:
+            return None
+        elapsed = ((self.finished_at or self.updated_at) - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return self.rows_processed / elapsed
+
+    class Meta:
+        ordering = ["id"]
+
+    def collect_shard_progress(self):
+        """Sum the counters and errors of the shards into this job, unsaved."""
+        totals = self.shards.aggregate(
+            loan_rows_processed=Sum("loan_rows_processed"),
+            cash_flow_rows_processed=Sum("cash_flow_rows_processed"),
+            rows_unchanged=Sum("rows_unchanged"),
+            loans_recalculated=Sum("loans_recalculated"),
+            error_count=Sum("error_count"),
+        )
+        for field, value in totals.items():
+            setattr(self, field, value or 0)
+
+        errors = []
+        for shard_errors in self.shards.values_list("errors", flat=True):
+            errors.extend(shard_errors)
+        errors.sort(key=lambda error: (error["file"] != "loans.csv", error["row"]))
+        self.errors = errors[:self.MAX_RECORDED_ERRORS]
+
+    def record_errors(self, errors):
+        self.error_count += len(errors)
+        room = self.MAX_RECORDED_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend(errors[:room])
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination over the primary key or another indexed field.
+
+    Clients choose the order with ``?ordering=<field>`` (``-<field>`` for
+    descending) among the view's ``ordering_fields`` and the page size with
+    ``?page_size=``.
+    """
+
+    ordering = "pk"
+    ordering_query_param = "ordering"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering and ordering.lstrip("-") in getattr(view, "ordering_fields", ()):
+            if ordering.lstrip("-") == "pk":
+                return (ordering,)
+            # A unique tiebreaker keeps the order stable across pages.
+            return (ordering, "-pk" if ordering.startswith("-") else "pk")
+        return (self.ordering,)
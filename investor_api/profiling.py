@@ -0,0 +1,151 @@
+"""Opt-in profiling of single requests, for admins.
+
+A request sent by an admin with ``?profile=1`` or an ``X-Profile: 1`` header
+runs under ``cProfile`` with every SQL query captured. The report (the
+slowest functions and the queries grouped by statement) is stored in the
+cache, and its id is returned in the ``X-Profile-Id`` response header, to be
+read from ``/profiles/<id>/``. Other requests only pay for the flag lookup.
+"""
+import cProfile
+import pstats
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+TOP_FUNCTIONS = 40
+TOP_QUERIES = 20
+
+
+def profile_requested(request):
+    return (
+        request.GET.get(PROFILE_QUERY_PARAM) == "1"
+        or request.headers.get(PROFILE_HEADER) == "1"
+    )
+
+
+def is_admin(request):
+    """Whether the session or the API credentials of ``request`` are an admin's.
+
+    API views authenticate in the view, after the middleware, so their
+    credentials are checked here too.
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except Exception:
+            return False
+        if result is not None:
+            return result[0].is_staff
+    return False
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = defaultdict(lambda: {"count": 0, "duration": 0.0})
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            query = self.queries[sql]
+            query["count"] += 1
+            query["duration"] += time.perf_counter() - started
+
+    def report(self):
+        queries = sorted(
+            self.queries.items(), key=lambda item: item[1]["duration"], reverse=True
+        )
+        return {
+            "count": sum(query["count"] for _, query in queries),
+            "duration_ms": sum(query["duration"] for _, query in queries) * 1000,
+            "statements": [
+                {
+                    "sql": sql,
+                    "count": query["count"],
+                    "duration_ms": query["duration"] * 1000,
+                }
+                for sql, query in queries[:TOP_QUERIES]
+            ],
+        }
+
+
+def _function_name(function):
+    file_name, line, name = function
+    return "%s:%s(%s)" % (file_name, line, name) if line else name
+
+
+def _functions_report(profiler):
+    stats = pstats.Stats(profiler)
+    functions = sorted(
+        stats.stats.items(), key=lambda item: item[1][3], reverse=True
+    )
+    return [
+        {
+            "function": _function_name(function),
+            "calls": calls,
+            "total_time_ms": total_time * 1000,
+            "cumulative_time_ms": cumulative_time * 1000,
+        }
+        for function, (_, calls, total_time, cumulative_time, _) in functions[
+            :TOP_FUNCTIONS
+        ]
+    ]
+
+
+def _profile_key(profile_id):
+    return "profiles:%s" % profile_id
+
+
+def profile_request(get_response, request):
+    """Run ``get_response(request)`` profiled and store the report."""
+    profiler = cProfile.Profile()
+    recorder = QueryRecorder()
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+    duration = time.perf_counter() - started
+
+    match = request.resolver_match
+    profile_id = uuid.uuid4().hex
+    cache.set(
+        _profile_key(profile_id),
+        {
+            "id": profile_id,
+            "created_at": timezone.now().isoformat(),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "duration_ms": duration * 1000,
+            "functions": _functions_report(profiler),
+            "sql": recorder.report(),
+        },
+        timeout=settings.PROFILE_TIMEOUT,
+    )
+    response[PROFILE_ID_HEADER] = profile_id
+    return response
+
+
+def get_profile(profile_id):
+    return cache.get(_profile_key(profile_id))
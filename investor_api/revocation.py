@@ -0,0 +1,31 @@
+"""Revocation of the JWTs already issued to a user.
+
+Tokens are authenticated from their claims alone, see ``authentication``,
+so deactivating a user or changing their roles records the time in the
+cache, in milliseconds, and tokens issued until then are rejected. The entry only has to
+outlive the access tokens already issued.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _revocation_key(user_id):
+    return "jwt:revoked:%s" % user_id
+
+
+def revoke_tokens(user_id):
+    cache.set(
+        _revocation_key(user_id),
+        int(time.time() * 1000),
+        timeout=int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds()),
+    )
+
+
+def tokens_revoked_at(user_id):
+    """Time in milliseconds until which the user's tokens are revoked."""
+    revoked_at = cache.get(_revocation_key(user_id))
+    if revoked_at is not None and revoked_at < 10**12:
+        # Recorded in seconds, before the switch to milliseconds.
+        revoked_at *= 1000
+    return revoked_at
@@ -1,5 +1,13 @@
 from rest_framework import serializers
-from .models import Loan, CashFlow, CustomUser
+from .caching import CASH_FLOW_NAMESPACES, invalidate
+from .models import (
+    Loan,
+    CashFlow,
+    CustomUser,
+    ImportJob,
+    PortfolioAggregate,
+    invalidate_cached_objects,
+)
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -19,13 +27,30 @@ class CustomUserSerializer(serializers.ModelSerializer):
         return user
 
 
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """A ModelSerializer that takes an optional ``fields`` argument to select
+    which of its fields are rendered."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
 class CashFlowSerializer(serializers.ModelSerializer):
+    # The foreign key points at Loan.identifier, so the column already holds
+    # the value to render and the related Loan never needs to be fetched.
+    loan_identifier = serializers.CharField(source='loan_identifier_id', read_only=True)
+
     class Meta:
         model = CashFlow
-        fields = '__all__'
+        fields = ['id', 'reference_date', 'type', 'amount', 'loan_identifier']
 
 
-class LoanDetailSerializer(serializers.ModelSerializer):
+class LoanDetailSerializer(DynamicFieldsModelSerializer):
     cash_flows = CashFlowSerializer(many=True)
 
     class Meta:
@@ -48,7 +73,7 @@ class LoanDetailSerializer(serializers.ModelSerializer):
 class CashFlowCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = CashFlow
-        fields = '__all__'
+        exclude = ['source_hash']
 
     def create(self, validated_data):
         loan_identifier = validated_data.pop('loan_identifier')
@@ -56,3 +81,88 @@ class CashFlowCreateSerializer(serializers.ModelSerializer):
         cash_flow = CashFlow.objects.create(loan_identifier=loan,
                                             **validated_data)
         return cash_flow
+
+
+class CashFlowBulkListSerializer(serializers.ListSerializer):
+    """Validate a list of cash flows, resolving all their loans in one query."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        loans = Loan.objects.in_bulk(
+            {item['loan_identifier'] for item in items}, field_name='identifier'
+        )
+        errors = [
+            {} if item['loan_identifier'] in loans
+            else {'loan_identifier': ['Loan %s does not exist.' % item['loan_identifier']]}
+            for item in items
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        for item in items:
+            item['loan_identifier'] = loans[item['loan_identifier']]
+        return items
+
+    def create(self, validated_data):
+        cash_flows = CashFlow.objects.bulk_create(
+            [CashFlow(**item) for item in validated_data]
+        )
+        # bulk_create does not send post_save.
+        Loan.apply_repayment_changes(cash_flows)
+        PortfolioAggregate.apply_delta(
+            {
+                'total_repaid_amount': sum(
+                    cash_flow.amount
+                    for cash_flow in cash_flows
+                    if cash_flow.type == 'Repayment'
+                )
+            }
+        )
+        invalidate(*CASH_FLOW_NAMESPACES)
+        invalidate_cached_objects(cash_flows=cash_flows)
+        return cash_flows
+
+
+class CashFlowBulkSerializer(serializers.ModelSerializer):
+    loan_identifier = serializers.CharField(max_length=256)
+
+    class Meta:
+        model = CashFlow
+        fields = ['reference_date', 'type', 'amount', 'loan_identifier']
+        list_serializer_class = CashFlowBulkListSerializer
+
+
+class ImportJobShardSerializer(serializers.ModelSerializer):
+    rows_processed = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'shard', 'status', 'phase', 'rows_processed', 'error_count', 'message']
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    rows_processed = serializers.IntegerField(read_only=True)
+    rows_per_second = serializers.FloatField(read_only=True)
+    shards = ImportJobShardSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ['id',
+                  'mode',
+                  'status',
+                  'phase',
+                  'loan_rows_processed',
+                  'cash_flow_rows_processed',
+                  'rows_processed',
+                  'rows_unchanged',
+                  'rows_per_second',
+                  'loans_recalculated',
+                  'error_count',
+                  'errors',
+                  'message',
+                  'created_at',
+                  'started_at',
+                  'updated_at',
+                  'finished_at',
+                  'shard_count',
+                  'shards']
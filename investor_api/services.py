@@ -1,81 +1,223 @@
-from pyxirr import xirr
-from investor_api.models import CashFlow, Loan
-from django.db.models import Sum
+from collections import defaultdict
+from investor_api.caching import LOAN_NAMESPACES, invalidate
+from investor_api.irr import batch_xirr, bullet_irr, day_number, pack_cash_flows
+from investor_api.models import (
+    CashFlow,
+    Loan,
+    PortfolioAggregate,
+    invalidate_cached_objects,
+)
+from django.db import transaction
 
 
-def calculate_investment_date(loan):
-    funding_cashflow = CashFlow.objects.filter(
-        loan_identifier=loan.identifier, type="Funding"
-    ).last()
+METRICS_BATCH_SIZE = 1000
+
+LOAN_METRIC_FIELDS = [
+    "investment_date",
+    "invested_amount",
+    "expected_interest_amount",
+    "is_closed",
+    "expected_irr",
+    "realized_irr",
+    "metrics_stale",
+]
+
+
+def _last_funding(cash_flows):
+    funding_cashflow = None
+    for cash_flow in cash_flows:
+        if cash_flow.type == "Funding":
+            funding_cashflow = cash_flow
+    return funding_cashflow
+
+
+def _repayments(cash_flows):
+    return [cash_flow for cash_flow in cash_flows if cash_flow.type == "Repayment"]
+
+
+def _irr_value(irr):
+    return None if irr != irr else float(irr)
+
+
+def _set_investment_date(loan, funding_cashflow):
     if funding_cashflow:
         loan.investment_date = funding_cashflow.reference_date
-        loan.save()
 
 
-def calculate_invested_amount(loan):
-    funding_cashflow = CashFlow.objects.filter(
-        loan_identifier=loan.identifier, type="Funding"
-    ).last()
-
+def _set_invested_amount(loan, funding_cashflow):
     if funding_cashflow:
         loan.invested_amount = abs(funding_cashflow.amount)
-        loan.save()
 
 
-def calculate_expected_interest_amount(loan):
-    total_expected_interest = loan.total_expected_interest_amount
-    total_amount = loan.total_amount
-    invested_amount = loan.invested_amount
-    loan.expected_interest_amount = float(total_expected_interest) * (
-        float(invested_amount) / float(total_amount)
+def _set_expected_interest_amount(loan):
+    if loan.invested_amount is None:
+        return
+    loan.expected_interest_amount = float(loan.total_expected_interest_amount) * (
+        float(loan.invested_amount) / float(loan.total_amount)
     )
-    loan.save()
 
 
-def calculate_expected_irr(loan):
-    cf = CashFlow.objects.filter(loan_identifier=loan.identifier, type="Funding").last()
+def _set_is_closed(loan):
+    # repaid_amount is maintained on every cash flow write, see
+    # Loan.apply_repayment_changes.
+    if not loan.repayment_count or loan.invested_amount is None:
+        return
+    expected_amount = loan.invested_amount + (loan.expected_interest_amount or 0)
+    loan.is_closed = loan.repaid_amount >= expected_amount
 
-    expected_irr = [
-        (cf.reference_date, cf.amount),
-        (loan.maturity_date, loan.invested_amount + loan.expected_interest_amount),
+
+def _set_expected_irrs(fundings):
+    """Set ``expected_irr`` for ``(loan, funding_cashflow)`` pairs in one call.
+
+    The expected cash flows are a bullet (the funding, then principal plus
+    interest at maturity), so the closed-form solution applies.
+    """
+    fundings = [
+        (loan, funding_cashflow)
+        for loan, funding_cashflow in fundings
+        if funding_cashflow and loan.expected_interest_amount is not None
     ]
+    if not fundings:
+        return
+    irrs = bullet_irr(
+        [funding_cashflow.amount for _, funding_cashflow in fundings],
+        [loan.invested_amount + loan.expected_interest_amount for loan, _ in fundings],
+        [
+            day_number(loan.maturity_date) - day_number(funding_cashflow.reference_date)
+            for loan, funding_cashflow in fundings
+        ],
+    )
+    for (loan, _), irr in zip(fundings, irrs):
+        loan.expected_irr = _irr_value(irr)
+
+
+def _set_realized_irrs(loans_cash_flows):
+    """Set ``realized_irr`` for ``(loan, cash_flows)`` pairs in one call."""
+    loans = []
+    groups = []
+    for loan, cash_flows in loans_cash_flows:
+        funding_cashflow = _last_funding(cash_flows)
+        if not loan.is_closed or not funding_cashflow:
+            continue
+        realized_irr = [(funding_cashflow.reference_date, funding_cashflow.amount)]
+        for repayment in _repayments(cash_flows):
+            realized_irr.append((repayment.reference_date, repayment.amount))
+        loans.append(loan)
+        groups.append(realized_irr)
+    if not loans:
+        return
+    for loan, irr in zip(loans, batch_xirr(*pack_cash_flows(groups))):
+        loan.realized_irr = _irr_value(irr)
+
+
+def _compute_loan_fields(loan, cash_flows):
+    loan.metrics_stale = False
+    funding_cashflow = _last_funding(cash_flows)
+    _set_investment_date(loan, funding_cashflow)
+    _set_invested_amount(loan, funding_cashflow)
+    _set_expected_interest_amount(loan)
+    _set_is_closed(loan)
+
+
+def compute_loan_irrs(loans, cash_flows_by_identifier):
+    """Set the expected and realized IRR of ``loans`` with one XIRR call each."""
+    loans_cash_flows = [
+        (loan, cash_flows_by_identifier.get(loan.identifier, [])) for loan in loans
+    ]
+    _set_expected_irrs(
+        [(loan, _last_funding(cash_flows)) for loan, cash_flows in loans_cash_flows]
+    )
+    _set_realized_irrs(loans_cash_flows)
 
-    loan.expected_irr = xirr(expected_irr)
-    loan.save()
 
+def compute_loan_metrics(loan, cash_flows):
+    """Derive every metric field of ``loan`` in memory from its cash flows.
 
-def calculate_realized_irr(loan):
-    if loan.is_closed:
-        cf = CashFlow.objects.filter(
-            loan_identifier=loan.identifier, type="Funding"
-        ).last()
-        cf_repayments = CashFlow.objects.filter(
-            loan_identifier=loan.identifier, type="Repayment"
-        )
+    ``cash_flows`` must be ordered by primary key, so the last Funding cash
+    flow wins as it does with ``QuerySet.last()``. Closure is read from the
+    loan's maintained ``repaid_amount``. Nothing is saved.
+    """
+    _compute_loan_fields(loan, cash_flows)
+    compute_loan_irrs([loan], {loan.identifier: cash_flows})
+    return loan
 
-        realized_irr = [(cf.reference_date, cf.amount)]
 
-        for repayment in cf_repayments:
-            realized_irr.append((repayment.reference_date, repayment.amount))
+def cash_flows_by_loan(loans):
+    grouped = defaultdict(list)
+    cash_flows = CashFlow.objects.filter(
+        loan_identifier__in=[loan.identifier for loan in loans]
+    ).order_by("pk")
+    for cash_flow in cash_flows:
+        grouped[cash_flow.loan_identifier_id].append(cash_flow)
+    return grouped
 
-        loan.realized_irr = xirr(realized_irr)
-        loan.save()
+
+def recalculate_loan_metrics(loans, batch_size=METRICS_BATCH_SIZE):
+    """Recompute the metrics of ``loans`` with one read and one write per batch.
+
+    ``loans`` must have been loaded from the database after their cash flows
+    were written, so their repayment totals and their previous contribution
+    to the portfolio aggregate are known.
+    """
+    loans = list(loans)
+
+    for start in range(0, len(loans), batch_size):
+        batch = loans[start : start + batch_size]
+        grouped = cash_flows_by_loan(batch)
+        for loan in batch:
+            _compute_loan_fields(loan, grouped[loan.identifier])
+        compute_loan_irrs(batch, grouped)
+        with transaction.atomic():
+            Loan.objects.bulk_update(batch, LOAN_METRIC_FIELDS)
+            PortfolioAggregate.apply_changes(batch)
+            invalidate(*LOAN_NAMESPACES)
+            invalidate_cached_objects(loans=batch)
+
+    return loans
+
+
+def _funding_cashflow(loan):
+    return CashFlow.objects.filter(
+        loan_identifier=loan.identifier, type="Funding"
+    ).last()
+
+
+def _loan_cash_flows(loan):
+    return list(CashFlow.objects.filter(loan_identifier=loan.identifier).order_by("pk"))
+
+
+def calculate_investment_date(loan):
+    _set_investment_date(loan, _funding_cashflow(loan))
+    loan.save(update_fields=["investment_date"])
+
+
+def calculate_invested_amount(loan):
+    _set_invested_amount(loan, _funding_cashflow(loan))
+    loan.save(update_fields=["invested_amount"])
+
+
+def calculate_expected_interest_amount(loan):
+    _set_expected_interest_amount(loan)
+    loan.save(update_fields=["expected_interest_amount"])
+
+
+def calculate_expected_irr(loan):
+    _set_expected_irrs([(loan, _funding_cashflow(loan))])
+    loan.save(update_fields=["expected_irr"])
+
+
+def calculate_realized_irr(loan):
+    if loan.is_closed:
+        _set_realized_irrs([(loan, _loan_cash_flows(loan))])
+        loan.save(update_fields=["realized_irr"])
 
 
 def calculate_is_closed(loan=None, loan_identifier=None):
     if not loan:
         loan = Loan.objects.get(identifier=loan_identifier)
 
-    total_repayment = CashFlow.objects.filter(
-        loan_identifier=loan.identifier, type="Repayment"
-    ).aggregate(total=Sum("amount"))["total"]
-
-    if total_repayment:
-        expected_amount = loan.invested_amount + loan.expected_interest_amount
-        if total_repayment >= expected_amount:
-            loan.is_closed = True
-            loan.save()
-            calculate_realized_irr(loan)
-        else:
-            loan.is_closed = False
-            loan.save()
+    loan.refresh_from_db(fields=Loan.REPAYMENT_FIELDS)
+    _set_is_closed(loan)
+    if loan.is_closed:
+        _set_realized_irrs([(loan, _loan_cash_flows(loan))])
+    loan.save(update_fields=["is_closed", "realized_irr"])
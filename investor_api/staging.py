@@ -0,0 +1,153 @@
+"""Spool directory for uploaded CSV files.
+
+Uploads are written to ``settings.CSV_SPOOL_DIR`` and only a small reference
+(file name and SHA-256 of the content) goes through the Celery broker. The
+worker streams the file back from disk and deletes it once it is processed.
+"""
+import gzip
+import hashlib
+import io
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from .models import ImportJob
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class StagedFileError(Exception):
+    pass
+
+
+def spool_dir():
+    path = Path(settings.CSV_SPOOL_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _staged_path(reference):
+    name = os.path.basename(reference["name"])
+    return spool_dir() / name
+
+
+class StagedFileWriter:
+    """Write a new staged file; it only appears in the spool once closed.
+
+    ``write`` takes text, so ``csv.writer`` can write to it directly.
+    """
+
+    def __init__(self, compress=None):
+        if compress is None:
+            compress = settings.CSV_SPOOL_COMPRESS
+        self.name = "%s.csv%s" % (uuid.uuid4().hex, ".gz" if compress else "")
+        self.path = spool_dir() / self.name
+        self.partial_path = self.path.with_name(self.name + ".part")
+        self.digest = hashlib.sha256()
+        opener = gzip.open if compress else open
+        self.file = opener(self.partial_path, "wb")
+
+    def write_bytes(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+
+    def write(self, text):
+        self.write_bytes(text.encode("utf-8"))
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+        return {"name": self.name, "sha256": self.digest.hexdigest()}
+
+    def discard(self):
+        self.file.close()
+        self.partial_path.unlink(missing_ok=True)
+
+
+def stage_upload(uploaded_file, compress=None):
+    """Write ``uploaded_file`` to the spool directory and return its reference."""
+    writer = StagedFileWriter(compress)
+    try:
+        for chunk in uploaded_file.chunks(COPY_CHUNK_SIZE):
+            writer.write_bytes(chunk)
+        return writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+
+
+def stage_content(content, compress=None):
+    """Write the text ``content`` to the spool directory and return its reference."""
+    writer = StagedFileWriter(compress)
+    try:
+        writer.write(content)
+        return writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+
+
+def _open_binary(path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def verify_staged(reference):
+    path = _staged_path(reference)
+    if not path.exists():
+        raise StagedFileError("Staged file %s does not exist." % reference["name"])
+
+    digest = hashlib.sha256()
+    with _open_binary(path) as staged:
+        for chunk in iter(lambda: staged.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != reference["sha256"]:
+        raise StagedFileError("Staged file %s is corrupted." % reference["name"])
+
+
+@contextmanager
+def open_staged(reference):
+    """Open a staged file as text, for ``csv.DictReader`` to stream from."""
+    with _open_binary(_staged_path(reference)) as staged:
+        with io.TextIOWrapper(staged, encoding="utf-8", newline="") as text:
+            yield text
+
+
+def discard_staged(*references):
+    for reference in references:
+        _staged_path(reference).unlink(missing_ok=True)
+
+
+def _staged_files_in_use():
+    """Names of the staged files of imports that are pending or running."""
+    names = set()
+    for references in ImportJob.objects.filter(
+        status__in=[ImportJob.PENDING, ImportJob.RUNNING]
+    ).values_list("loan_csv", "cash_flow_csv"):
+        names.update(os.path.basename(reference["name"]) for reference in references)
+    return names
+
+
+def purge_staged_files(max_age=None):
+    """Delete staged files older than ``max_age`` seconds, left by failed imports.
+
+    Files of imports that are still pending or running are kept whatever
+    their age: they can wait long in the queue, or be resumed after a crash.
+    """
+    if max_age is None:
+        max_age = settings.CSV_SPOOL_MAX_AGE
+
+    deadline = time.time() - max_age
+    in_use = _staged_files_in_use()
+    purged = 0
+    for path in spool_dir().iterdir():
+        if path.name in in_use:
+            continue
+        if path.is_file() and path.stat().st_mtime < deadline:
+            path.unlink(missing_ok=True)
+            purged += 1
+    return purged
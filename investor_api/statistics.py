@@ -0,0 +1,140 @@
+from datetime import timedelta
+from django.db.models import F, Q, Sum, Window
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from .caching import STATISTICS, single_flight
+from .models import CashFlow, Loan, PortfolioAggregate
+
+
+BUCKETS = {
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+
+def bucket_start(value, bucket):
+    if bucket == "week":
+        return value - timedelta(days=value.weekday())
+    if bucket == "month":
+        return value.replace(day=1)
+    return value
+
+
+def loan_totals(start=None, end=None):
+    """Invested and repaid amount of every invested loan, in one GROUP BY query.
+
+    ``start`` and ``end`` restrict the loans by investment date.
+    """
+    loans = Loan.objects.filter(invested_amount__isnull=False).exclude(
+        invested_amount=0
+    )
+    if start:
+        loans = loans.filter(investment_date__gte=start)
+    if end:
+        loans = loans.filter(investment_date__lte=end)
+
+    return list(
+        loans.order_by("pk")
+        .values("identifier", "invested_amount")
+        .annotate(
+            repaid_amount=Sum(
+                "cash_flows__amount",
+                filter=Q(cash_flows__type="Repayment"),
+                default=0,
+            )
+        )
+    )
+
+
+def cumulative_series(bucket="day", start=None, end=None):
+    """Cumulative invested and repaid amounts at the end of each bucket.
+
+    The running totals are computed by the database with a window function
+    partitioned by cash-flow type. Cash flows before ``start`` still count
+    towards the totals; only the buckets before it are left out.
+    """
+    cash_flows = CashFlow.objects.all()
+    if end:
+        cash_flows = cash_flows.filter(reference_date__lte=end)
+
+    rows = (
+        cash_flows.annotate(bucket=BUCKETS[bucket]("reference_date"))
+        .annotate(
+            cumulative_amount=Window(
+                Sum("amount"),
+                partition_by=[F("type")],
+                order_by=F("bucket").asc(),
+            )
+        )
+        .values_list("bucket", "type", "cumulative_amount")
+        .distinct()
+        .order_by("bucket")
+    )
+
+    totals_by_bucket = {}
+    for bucket_date, cash_flow_type, cumulative_amount in rows:
+        totals_by_bucket.setdefault(bucket_date, {})[cash_flow_type] = cumulative_amount
+
+    first_bucket = bucket_start(start, bucket) if start else None
+    invested_amount = 0
+    repaid_amount = 0
+    series = []
+    for bucket_date in sorted(totals_by_bucket):
+        totals = totals_by_bucket[bucket_date]
+        invested_amount = totals.get("Funding", invested_amount)
+        repaid_amount = totals.get("Repayment", repaid_amount)
+        if first_bucket and bucket_date < first_bucket:
+            continue
+        series.append(
+            {
+                "date": bucket_date.isoformat(),
+                "invested_amount": abs(invested_amount),
+                "repaid_amount": repaid_amount,
+            }
+        )
+    return series
+
+
+def basic_statistics():
+    aggregate = PortfolioAggregate.load()
+    return {
+        "number_of_loans": aggregate.loan_count,
+        "total_invested_amount": aggregate.total_invested_amount,
+        "current_invested_amount": aggregate.current_invested_amount,
+        "total_repaid_amount": aggregate.total_repaid_amount,
+        "average_realized_irr": aggregate.average_realized_irr,
+    }
+
+
+def series_statistics(bucket="day", start=None, end=None):
+    return {
+        "bucket": bucket,
+        "loans": loan_totals(start, end),
+        "series": cumulative_series(bucket, start, end),
+    }
+
+
+# Both return ``(statistics, version)``, see ``single_flight``.
+def cached_basic_statistics():
+    return single_flight(STATISTICS, "basic", basic_statistics)
+
+
+def cached_series_statistics(bucket="day", start=None, end=None):
+    name = ":".join(
+        [
+            "series",
+            bucket,
+            start.isoformat() if start else "",
+            end.isoformat() if end else "",
+        ]
+    )
+    return single_flight(
+        STATISTICS, name, lambda: series_statistics(bucket, start, end)
+    )
+
+
+def prewarm_statistics():
+    """Compute the statistics served without filters for the current data."""
+    cached_basic_statistics()
+    for bucket in BUCKETS:
+        cached_series_statistics(bucket)
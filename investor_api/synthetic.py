@@ -0,0 +1,161 @@
+"""Synthetic portfolios in the CSV upload format, for benchmarks and load tests.
+
+Portfolios are generated one loan at a time from a seeded random generator,
+so the same arguments always produce the same files and a million loans can
+be written without holding them in memory.
+"""
+import csv
+import math
+import random
+from datetime import date, timedelta
+from itertools import accumulate
+from .imports import CASH_FLOW_COLUMNS, LOAN_COLUMNS
+
+
+MAX_LOANS = 1000000
+
+CASH_FLOW_CSV_COLUMNS = ["loan_identifier"] + CASH_FLOW_COLUMNS
+
+# Relative weights; ratings go from 1 (best) to 9.
+DEFAULT_RATING_MIX = {1: 5, 2: 10, 3: 15, 4: 20, 5: 20, 6: 12, 7: 8, 8: 6, 9: 4}
+
+# amortizing: monthly instalments until maturity.
+# bullet: principal and interest repaid at once at maturity.
+# early: amortizing, then the outstanding amount repaid before maturity.
+# default: amortizing until the borrower stops paying.
+# unfunded: listed but never invested in, so it has no cash flows.
+DEFAULT_PATTERN_MIX = {
+    "amortizing": 50,
+    "bullet": 20,
+    "early": 15,
+    "default": 10,
+    "unfunded": 5,
+}
+
+DEFAULT_AS_OF = date(2023, 1, 1)
+
+
+class PortfolioGenerator:
+    """Generate ``loan_count`` loans issued in the three years before ``as_of``.
+
+    Cash flows dated after ``as_of`` are left out, so recent loans are still
+    open while older ones are repaid, prepaid or in default.
+    """
+
+    def __init__(
+        self,
+        loan_count,
+        rating_mix=None,
+        pattern_mix=None,
+        seed=0,
+        as_of=DEFAULT_AS_OF,
+        prefix="SYN",
+    ):
+        if not 0 <= loan_count <= MAX_LOANS:
+            raise ValueError("loan_count must be between 0 and %s." % MAX_LOANS)
+        rating_mix = rating_mix or DEFAULT_RATING_MIX
+        pattern_mix = pattern_mix or DEFAULT_PATTERN_MIX
+        for mix, choices, name in (
+            (rating_mix, DEFAULT_RATING_MIX, "rating"),
+            (pattern_mix, DEFAULT_PATTERN_MIX, "repayment pattern"),
+        ):
+            unknown = set(mix) - set(choices)
+            if unknown:
+                raise ValueError(
+                    "Unknown %s: %s." % (name, ", ".join(map(str, sorted(unknown))))
+                )
+            if any(weight < 0 for weight in mix.values()) or not sum(mix.values()):
+                raise ValueError("The %s weights must be non-negative and not all zero." % name)
+
+        self.loan_count = loan_count
+        self.ratings = list(rating_mix)
+        self.rating_weights = list(accumulate(rating_mix.values()))
+        self.patterns = list(pattern_mix)
+        self.pattern_weights = list(accumulate(pattern_mix.values()))
+        self.seed = seed
+        self.as_of = as_of
+        self.prefix = prefix
+
+    def __iter__(self):
+        """Yield ``(loan_row, cash_flow_rows)`` for every loan."""
+        rng = random.Random(self.seed)
+        for number in range(self.loan_count):
+            yield self._loan(rng, number)
+
+    def _loan(self, rng, number):
+        rating = rng.choices(self.ratings, cum_weights=self.rating_weights)[0]
+        pattern = rng.choices(self.patterns, cum_weights=self.pattern_weights)[0]
+        term = rng.choice([3, 6, 12, 18, 24, 36])
+        issue_date = self.as_of - timedelta(days=rng.randrange(3 * 365))
+        total_amount = rng.randrange(10, 1000) * 500
+        annual_rate = 0.03 + 0.015 * rating + rng.uniform(-0.01, 0.01)
+        total_interest = round(total_amount * annual_rate * term / 12, 2)
+
+        loan = {
+            "identifier": "%s%07d" % (self.prefix, number),
+            "issue_date": issue_date.isoformat(),
+            "total_amount": total_amount,
+            "rating": rating,
+            "maturity_date": (issue_date + timedelta(days=30 * term)).isoformat(),
+            "total_expected_interest_amount": total_interest,
+        }
+        if pattern == "unfunded":
+            return loan, []
+
+        share = rng.choice([0.25, 0.5, 0.75, 1])
+        invested_amount = total_amount * share
+        investment_date = issue_date + timedelta(days=rng.randrange(7))
+        cash_flows = [(investment_date, "Funding", -invested_amount)]
+
+        # A cent over, so float rounding never leaves a repaid loan open.
+        owed = math.ceil((invested_amount + total_interest * share) * 100) + 1
+        if pattern == "bullet":
+            cash_flows.append(
+                (investment_date + timedelta(days=30 * term), "Repayment", owed)
+            )
+        else:
+            paid_months = term
+            if pattern == "early":
+                paid_months = rng.randrange(1, term)
+            elif pattern == "default":
+                paid_months = rng.randrange(term)
+            instalment = owed // term
+            for month in range(1, paid_months + 1):
+                amount = instalment
+                if month == term or (pattern == "early" and month == paid_months):
+                    amount = owed - instalment * (month - 1)
+                cash_flows.append(
+                    (investment_date + timedelta(days=30 * month), "Repayment", amount)
+                )
+
+        cash_flow_rows = []
+        for reference_date, cash_flow_type, amount in cash_flows:
+            if reference_date > self.as_of:
+                break
+            if cash_flow_type == "Repayment":
+                amount = amount / 100
+            cash_flow_rows.append(
+                {
+                    "loan_identifier": loan["identifier"],
+                    "reference_date": reference_date.isoformat(),
+                    "type": cash_flow_type,
+                    "amount": amount,
+                }
+            )
+        return loan, cash_flow_rows
+
+    def write_csv(self, loan_file, cash_flow_file):
+        """Write the portfolio to two CSV files and return ``(loans, cash_flows)``."""
+        loan_writer = csv.DictWriter(loan_file, LOAN_COLUMNS, lineterminator="\n")
+        cash_flow_writer = csv.DictWriter(
+            cash_flow_file, CASH_FLOW_CSV_COLUMNS, lineterminator="\n"
+        )
+        loan_writer.writeheader()
+        cash_flow_writer.writeheader()
+
+        cash_flow_count = 0
+        for loan, cash_flows in self:
+            loan_writer.writerow(loan)
+            cash_flow_writer.writerows(cash_flows)
+            cash_flow_count += len(cash_flows)
+        return self.loan_count, cash_flow_count
@@ -1,47 +1,134 @@
-from celery import shared_task
-from .models import Loan, CashFlow
-import csv
-from io import StringIO
-from .services import (
-    calculate_investment_date,
-    calculate_invested_amount,
-    calculate_expected_interest_amount,
-    calculate_is_closed,
-    calculate_expected_irr,
-    calculate_realized_irr,
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from .caching import (
+    STATISTICS,
+    data_version_changed,
+    get_data_version,
+    store_rendered_charts,
+    versioned_key,
 )
+from .imports import (
+    IMPORT_BATCH_SIZE,
+    abort_sharded_import,
+    finish_sharded_import,
+    run_import,
+    shard_finished,
+    split_import,
+)
+from .models import ImportJob
+import logging
+from .staging import discard_staged, purge_staged_files, stage_content
+from .statistics import prewarm_statistics
+
+
+logger = logging.getLogger(__name__)
+
+CHART_RENDER_LOCK_TIMEOUT = 60 * 5
 
 
 @shared_task
-def process_csv(loan_csv_content, cash_flow_csv_content):
-    loan_csv = csv.DictReader(StringIO(loan_csv_content))
-    cash_flow_csv = csv.DictReader(StringIO(cash_flow_csv_content))
-    loans_created = []
-
-    for row in loan_csv:
-        loan = Loan.objects.create(
-            identifier=row["identifier"],
-            issue_date=row["issue_date"],
-            total_amount=row["total_amount"],
-            rating=row["rating"],
-            maturity_date=row["maturity_date"],
-            total_expected_interest_amount=row["total_expected_interest_amount"],
-        )
-        loans_created.append(loan)
-
-    for row in cash_flow_csv:
-        loan = Loan.objects.get(identifier=row["loan_identifier"])
-        cash_flow = CashFlow.objects.create(
-            loan_identifier=loan,
-            reference_date=row["reference_date"],
-            type=row["type"],
-            amount=row["amount"],
+def process_csv(loan_csv_content, cash_flow_csv_content, batch_size=IMPORT_BATCH_SIZE):
+    """Import CSV content passed inline, as an import job run by this task."""
+    references = []
+    try:
+        references.append(stage_content(loan_csv_content))
+        references.append(stage_content(cash_flow_csv_content))
+        job = ImportJob.objects.create(
+            loan_csv=references[0], cash_flow_csv=references[1]
         )
+    except BaseException:
+        discard_staged(*references)
+        raise
+    return run_import(job, batch_size).id
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def run_import_job(job_id, batch_size=IMPORT_BATCH_SIZE):
+    """Run an import job; redelivered after a worker crash, it resumes.
+
+    With ``CSV_IMPORT_SHARDS`` above one the job is split into shards that
+    run as a chord, so every worker takes part.
+    """
+    job = ImportJob.objects.get(pk=job_id)
+    if settings.CSV_IMPORT_SHARDS <= 1 and not job.shard_count:
+        run_import(job, batch_size)
+        return
+
+    shards = split_import(job, job.shard_count or settings.CSV_IMPORT_SHARDS)
+    chord(run_import_shard.si(shard.id, batch_size) for shard in shards)(
+        finish_import_job.si(job.id)
+    )
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def run_import_shard(shard_id, batch_size=IMPORT_BATCH_SIZE):
+    shard = ImportJob.objects.select_related("parent").get(pk=shard_id)
+    try:
+        run_import(shard, batch_size)
+    except Exception as error:
+        abort_sharded_import(shard.parent, shard, error)
+        raise
+    shard_finished(shard)
+
+
+@shared_task
+def finish_import_job(job_id):
+    finish_sharded_import(ImportJob.objects.get(pk=job_id))
+
+
+@shared_task
+def purge_staged_csv():
+    purged = purge_staged_files()
+    if purged:
+        logger.info("Purged %s stale staged CSV files.", purged)
+
+
+def _chart_rendering_lock_key(version):
+    return versioned_key(STATISTICS, "charts", "rendering", version=version)
+
+
+@shared_task
+def render_statistics_charts(version):
+    # Imported here so that only the workers rendering charts load matplotlib.
+    from .charts import render_charts
+
+    try:
+        store_rendered_charts(version, render_charts())
+    finally:
+        cache.delete(_chart_rendering_lock_key(version))
+
+
+def schedule_chart_rendering():
+    """Queue one chart rendering for the current statistics data version."""
+    version = get_data_version(STATISTICS)
+    lock_key = _chart_rendering_lock_key(version)
+    if not cache.add(lock_key, True, timeout=CHART_RENDER_LOCK_TIMEOUT):
+        return
+    try:
+        render_statistics_charts.delay(version)
+    except Exception:
+        cache.delete(lock_key)
+        logger.exception("Could not queue the statistics charts rendering.")
+
+
+@shared_task
+def prewarm_statistics_cache():
+    prewarm_statistics()
+
+
+@receiver(data_version_changed)
+def render_charts_on_data_change(sender, namespaces, **kwargs):
+    if STATISTICS in namespaces:
+        schedule_chart_rendering()
+
 
-    for loan in loans_created:
-        calculate_investment_date(loan)
-        calculate_invested_amount(loan)
-        calculate_expected_interest_amount(loan)
-        calculate_is_closed(loan)
-        calculate_expected_irr(loan)
-        calculate_realized_irr(loan)
\ No newline at end of file
+@receiver(data_version_changed)
+def prewarm_statistics_on_data_change(sender, namespaces, **kwargs):
+    if STATISTICS not in namespaces:
+        return
+    try:
+        prewarm_statistics_cache.delay()
+    except Exception:
+        logger.exception("Could not queue the statistics cache prewarming.")
@@ -0,0 +1,105 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from investor_api.models import CustomUser
+from investor_api.revocation import revoke_tokens, tokens_revoked_at
+from investor_api.tasks import process_csv
+from investor_api.tests.test_tasks import CASH_FLOW_CSV, LOAN_CSV
+
+
+class StatelessJWTAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.analyst = CustomUser.objects.create_user(
+            username="analyst", password="secret", is_analyst=True
+        )
+        self.client = APIClient()
+
+    def obtain_token(self, username="analyst", password="secret"):
+        response = self.client.post(
+            "/token/", {"username": username, "password": password}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data["access"]
+
+    def get(self, path, token):
+        return self.client.get(path, HTTP_AUTHORIZATION="Bearer %s" % token)
+
+    def test_roles_come_from_the_token(self):
+        token = self.obtain_token()
+
+        # Only the loans page; the user is not loaded.
+        with self.assertNumQueries(2):
+            response = self.get("/loans/", token)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get("/users/", token).status_code, 403)
+
+    def test_login_does_not_revoke_tokens(self):
+        self.obtain_token()
+
+        self.assertIsNone(tokens_revoked_at(self.analyst.pk))
+
+    def test_deactivation_revokes_tokens(self):
+        token = self.obtain_token()
+
+        analyst = CustomUser.objects.get(pk=self.analyst.pk)
+        analyst.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            analyst.save()
+
+        response = self.get("/loans/", token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["code"], "token_revoked")
+
+    def test_role_change_revokes_tokens(self):
+        token = self.obtain_token()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomUser.objects.get(pk=self.analyst.pk).save()
+        self.assertEqual(self.get("/loans/", token).status_code, 200)
+
+        analyst = CustomUser.objects.get(pk=self.analyst.pk)
+        analyst.is_analyst = False
+        with self.captureOnCommitCallbacks(execute=True):
+            analyst.save()
+            # Not before the commit: a token issued meanwhile would outlive it.
+            self.assertIsNone(tokens_revoked_at(self.analyst.pk))
+        self.assertEqual(self.get("/loans/", token).status_code, 401)
+
+    def test_token_obtained_after_the_role_change_is_accepted(self):
+        investor = CustomUser.objects.create_user(
+            username="investor", password="secret"
+        )
+        investor.is_investor = True
+        with self.captureOnCommitCallbacks(execute=True):
+            investor.save()
+        self.assertIsNotNone(tokens_revoked_at(investor.pk))
+
+        # Within the same second as the revocation.
+        token = self.obtain_token("investor")
+        self.assertEqual(self.get("/loans/", token).status_code, 200)
+
+    def test_deletion_revokes_tokens(self):
+        token = self.obtain_token()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.analyst.delete()
+
+        self.assertEqual(self.get("/loans/", token).status_code, 401)
+
+    def test_tokens_without_role_claims_load_the_user(self):
+        token = RefreshToken.for_user(self.analyst).access_token
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get("/loans/", token).status_code, 200)
+
+        CustomUser.objects.filter(pk=self.analyst.pk).update(is_active=False)
+        self.assertEqual(self.get("/loans/", token).status_code, 401)
+
+    def test_revocation_expires_with_access_tokens(self):
+        revoke_tokens(self.analyst.pk)
+
+        self.assertLessEqual(cache.ttl("jwt:revoked:%s" % self.analyst.pk), 60 * 60)
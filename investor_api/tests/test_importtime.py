@@ -0,0 +1,27 @@
+from django.test import SimpleTestCase
+from investor_api.importtime import measure_import_time, total_import_time
+
+
+# Startup budgets for django.setup() plus URL loading. The module count is
+# deterministic for pinned requirements; the time leaves room for slow CI.
+MAX_IMPORTED_MODULES = 1100
+MAX_IMPORT_SECONDS = 1.0
+
+
+class StartupImportTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.modules = measure_import_time()
+
+    def test_charts_are_not_imported(self):
+        self.assertIn("investor_api.views", self.modules)
+        self.assertIn("investor_api.tasks", self.modules)
+        self.assertNotIn("investor_api.charts", self.modules)
+        self.assertEqual(
+            [name for name in self.modules if name.startswith("matplotlib")], []
+        )
+
+    def test_import_budget(self):
+        self.assertLessEqual(len(self.modules), MAX_IMPORTED_MODULES)
+        self.assertLessEqual(total_import_time(self.modules), MAX_IMPORT_SECONDS)
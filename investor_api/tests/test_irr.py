@@ -0,0 +1,42 @@
+import math
+from datetime import date
+from django.test import SimpleTestCase
+from pyxirr import xirr
+from investor_api.irr import batch_xirr, bullet_irr, pack_cash_flows
+
+
+class BatchXirrTestCase(SimpleTestCase):
+    def setUp(self):
+        self.loans = [
+            [(date(2022, 2, 1), -500), (date(2022, 3, 1), 250), (date(2023, 2, 1), 560)],
+            [(date(2021, 6, 3), -55000), (date(2021, 10, 3), 55030)],
+            [
+                (date(2021, 5, 1), -100000),
+                (date(2021, 7, 1), 40000),
+                (date(2021, 9, 1), 40000),
+                (date(2021, 12, 1), 30000),
+            ],
+        ]
+
+    def test_batch_xirr_matches_pyxirr(self):
+        irrs = batch_xirr(*pack_cash_flows(self.loans))
+
+        self.assertEqual(len(irrs), len(self.loans))
+        for loan, irr in zip(self.loans, irrs):
+            self.assertAlmostEqual(irr, xirr(loan), places=7)
+
+    def test_batch_xirr_without_solution(self):
+        irrs = batch_xirr(
+            *pack_cash_flows(
+                [[(date(2022, 1, 1), 100), (date(2022, 6, 1), 100)], self.loans[0]]
+            )
+        )
+
+        self.assertTrue(math.isnan(irrs[0]))
+        self.assertAlmostEqual(irrs[1], xirr(self.loans[0]), places=7)
+
+    def test_bullet_irr(self):
+        irrs = bullet_irr([-1000, -1000], [1100, 1100], [365, 0])
+
+        self.assertAlmostEqual(irrs[0], 0.1, places=12)
+        self.assertTrue(math.isnan(irrs[1]))
@@ -1,6 +1,9 @@
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
 from django.core.cache import cache
-from investor_api.models import CustomUser, Loan, CashFlow
+from investor_api.caching import STATISTICS, deferred_invalidation, get_data_version
+from investor_api.models import CustomUser, Loan, CashFlow, PortfolioAggregate
 
 
 class CustomUserModelTests(TestCase):
@@ -107,3 +110,209 @@ class CashFlowModelTests(TestCase):
         )
 
         self.assertEqual(cache.get("foo"), None)
+
+
+class DataVersionTests(TestCase):
+    def create_loan(self, identifier):
+        return Loan.objects.create(
+            identifier=identifier,
+            issue_date="2022-01-01",
+            total_amount=1000,
+            rating=5,
+            maturity_date="2023-01-01",
+            total_expected_interest_amount=100,
+        )
+
+    def test_save_bumps_data_version_on_commit(self):
+        cache.set("unrelated", "value")
+        version = get_data_version(STATISTICS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = self.create_loan("loan1")
+            CashFlow.objects.create(
+                reference_date="2022-02-01",
+                type="Funding",
+                amount=-500,
+                loan_identifier=loan,
+            )
+            self.assertEqual(get_data_version(STATISTICS), version)
+
+        self.assertEqual(get_data_version(STATISTICS), version + 1)
+        self.assertEqual(cache.get("unrelated"), "value")
+
+    def test_deferred_invalidation_bumps_once(self):
+        version = get_data_version(STATISTICS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with deferred_invalidation():
+                self.create_loan("loan1")
+                self.create_loan("loan2")
+
+        self.assertEqual(get_data_version(STATISTICS), version + 1)
+
+
+class PortfolioAggregateTests(TestCase):
+    FIELDS = [
+        "loan_count",
+        "total_invested_amount",
+        "current_invested_amount",
+        "total_repaid_amount",
+        "closed_invested_amount",
+        "closed_weighted_irr",
+    ]
+
+    def assertAggregateIsConsistent(self):
+        maintained = PortfolioAggregate.load()
+        maintained = {field: getattr(maintained, field) for field in self.FIELDS}
+        rebuilt = PortfolioAggregate.rebuild()
+        for field in self.FIELDS:
+            self.assertAlmostEqual(maintained[field], getattr(rebuilt, field))
+
+    def test_aggregate_follows_writes(self):
+        loan = Loan.objects.create(
+            identifier="loan1",
+            issue_date="2022-01-01",
+            total_amount=1000,
+            rating=5,
+            maturity_date="2023-01-01",
+            total_expected_interest_amount=100,
+        )
+        CashFlow.objects.create(
+            reference_date="2022-02-01",
+            type="Funding",
+            amount=-500,
+            loan_identifier=loan,
+        )
+        repayment = CashFlow.objects.create(
+            reference_date="2022-12-01",
+            type="Repayment",
+            amount=560,
+            loan_identifier=loan,
+        )
+        self.assertAggregateIsConsistent()
+
+        loan = Loan.objects.get(pk=loan.pk)
+        loan.invested_amount = 500
+        loan.is_closed = True
+        loan.realized_irr = 0.12
+        loan.save()
+        self.assertAggregateIsConsistent()
+        self.assertAlmostEqual(PortfolioAggregate.load().average_realized_irr, 0.12)
+
+        CashFlow.objects.get(pk=repayment.pk).delete()
+        self.assertAggregateIsConsistent()
+        self.assertEqual(PortfolioAggregate.load().total_repaid_amount, 0)
+
+        Loan.objects.get(pk=loan.pk).delete()
+        self.assertAggregateIsConsistent()
+        self.assertEqual(PortfolioAggregate.load().loan_count, 0)
+
+
+class RepaymentTotalsTests(TestCase):
+    def setUp(self):
+        self.loan = Loan.objects.create(
+            identifier="loan1",
+            issue_date="2022-01-01",
+            total_amount=1000,
+            rating=5,
+            maturity_date="2023-01-01",
+            total_expected_interest_amount=100,
+        )
+        CashFlow.objects.create(
+            loan_identifier=self.loan,
+            reference_date="2022-01-01",
+            type="Funding",
+            amount=-1000,
+        )
+        self.repayment = CashFlow.objects.create(
+            loan_identifier=self.loan,
+            reference_date="2022-06-01",
+            type="Repayment",
+            amount=300,
+        )
+
+    def assertRepaymentTotals(self, repaid_amount, repayment_count):
+        loan = Loan.objects.get(pk=self.loan.pk)
+        self.assertEqual(loan.repaid_amount, repaid_amount)
+        self.assertEqual(loan.repayment_count, repayment_count)
+
+    def test_totals_follow_cash_flow_writes(self):
+        self.assertRepaymentTotals(300, 1)
+
+        repayment = CashFlow.objects.get(pk=self.repayment.pk)
+        repayment.amount = 350
+        repayment.save()
+        self.assertRepaymentTotals(350, 1)
+
+        CashFlow.objects.create(
+            loan_identifier=self.loan,
+            reference_date="2022-07-01",
+            type="Repayment",
+            amount=50,
+        )
+        self.assertRepaymentTotals(400, 2)
+
+        repayment.delete()
+        self.assertRepaymentTotals(50, 1)
+
+    def test_full_save_keeps_totals(self):
+        self.loan.rating = 6
+        self.loan.save()
+
+        self.assertRepaymentTotals(300, 1)
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).rating, 6)
+
+    def test_full_save_of_deferred_loan_writes_loaded_fields(self):
+        Loan.objects.filter(pk=self.loan.pk).update(total_amount=2000)
+        loan = Loan.objects.only("identifier", "rating").get(pk=self.loan.pk)
+        loan.rating = 7
+
+        with self.assertNumQueries(1):
+            loan.save()
+
+        loan = Loan.objects.get(pk=self.loan.pk)
+        self.assertEqual(loan.rating, 7)
+        self.assertEqual(loan.total_amount, 2000)
+
+    def test_full_save_of_deleted_loan_inserts_it(self):
+        Loan.objects.filter(pk=self.loan.pk).delete()
+        self.loan.rating = 6
+        self.loan.save()
+
+        self.assertEqual(Loan.objects.get(pk=self.loan.pk).rating, 6)
+
+    def test_reconcile_command(self):
+        Loan.objects.update(repaid_amount=0, repayment_count=7)
+        out = StringIO()
+
+        call_command("reconcile_loan_repayments", stdout=out)
+
+        self.assertRepaymentTotals(300, 1)
+        self.assertIn("rebuilt for 1 loans", out.getvalue())
+
+
+class QueryPlanTests(TestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn("USING INDEX %s" % index_name, plan)
+
+    def test_cash_flows_by_loan_and_type(self):
+        self.assertUsesIndex(
+            CashFlow.objects.filter(loan_identifier="L101", type="Repayment"),
+            "cashflow_loan_type_date_idx",
+        )
+        self.assertUsesIndex(
+            CashFlow.objects.filter(loan_identifier__in=["L101", "L102"]).order_by("pk"),
+            "cashflow_loan_type_date_idx",
+        )
+
+    def test_cash_flows_ordered_by_reference_date(self):
+        self.assertUsesIndex(
+            CashFlow.objects.order_by("reference_date"), "cashflow_reference_date_idx"
+        )
+
+    def test_loan_filters(self):
+        self.assertUsesIndex(Loan.objects.filter(rating=3), "loan_rating_idx")
+        self.assertUsesIndex(
+            Loan.objects.filter(maturity_date="2021-09-01"), "loan_maturity_date_idx"
+        )
@@ -7,6 +7,8 @@ from investor_api.services import (
     calculate_expected_irr,
     calculate_realized_irr,
     calculate_is_closed,
+    compute_loan_metrics,
+    recalculate_loan_metrics,
 )
 from datetime import datetime, timedelta
 from pyxirr import xirr
@@ -92,7 +94,8 @@ class UtilsTestCase(TestCase):
         self.loan.expected_interest_amount = 40
         self.loan.save()
 
-        calculate_is_closed(loan=self.loan)
+        with self.assertNumQueries(2):
+            calculate_is_closed(loan=self.loan)
 
         self.assertEqual(self.loan.is_closed, False)
 
@@ -107,3 +110,66 @@ class UtilsTestCase(TestCase):
 
         self.assertEqual(self.loan.is_closed, True)
         self.assertAlmostEqual(self.loan.realized_irr, 1.1211098911638433, places=7)
+
+
+class LoanMetricsTestCase(TestCase):
+    def setUp(self):
+        self.loan = Loan.objects.create(
+            identifier="loan1",
+            issue_date="2022-01-01",
+            total_amount=1000,
+            rating=5,
+            maturity_date="2023-01-01",
+            total_expected_interest_amount=100,
+        )
+        self.cf1 = CashFlow.objects.create(
+            reference_date="2022-02-01",
+            type="Funding",
+            amount=-500,
+            loan_identifier=self.loan,
+        )
+        self.cf2 = CashFlow.objects.create(
+            reference_date="2022-12-01",
+            type="Repayment",
+            amount=560,
+            loan_identifier=self.loan,
+        )
+
+    def test_compute_loan_metrics(self):
+        loan = Loan.objects.get(pk=self.loan.pk)
+        compute_loan_metrics(loan, [self.cf1, self.cf2])
+
+        self.assertEqual(loan.investment_date, "2022-02-01")
+        self.assertEqual(loan.invested_amount, 500)
+        self.assertEqual(loan.expected_interest_amount, 50)
+        self.assertTrue(loan.is_closed)
+        self.assertAlmostEqual(
+            loan.expected_irr,
+            xirr([(self.cf1.reference_date, -500), (loan.maturity_date, 550)]),
+            places=7,
+        )
+        self.assertAlmostEqual(
+            loan.realized_irr,
+            xirr([(self.cf1.reference_date, -500), (self.cf2.reference_date, 560)]),
+            places=7,
+        )
+
+    def test_compute_loan_metrics_without_cash_flows(self):
+        loan = Loan.objects.get(pk=self.loan.pk)
+        compute_loan_metrics(loan, [])
+
+        self.assertIsNone(loan.invested_amount)
+        self.assertIsNone(loan.expected_interest_amount)
+        self.assertFalse(loan.is_closed)
+        self.assertIsNone(loan.expected_irr)
+
+    def test_recalculate_loan_metrics(self):
+        loans = list(Loan.objects.all())
+
+        with self.assertNumQueries(5):
+            recalculate_loan_metrics(loans)
+
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.invested_amount, 500)
+        self.assertTrue(self.loan.is_closed)
+        self.assertIsNotNone(self.loan.realized_irr)
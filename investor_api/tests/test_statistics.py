@@ -0,0 +1,164 @@
+from datetime import date
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+from investor_api.caching import (
+    STATISTICS,
+    bump_data_version,
+    get_data_version,
+    single_flight,
+    versioned_key,
+)
+from investor_api.models import CustomUser
+from investor_api.statistics import cumulative_series, loan_totals
+from investor_api.tasks import (
+    prewarm_statistics_cache,
+    process_csv,
+    render_statistics_charts,
+)
+from investor_api.tests.test_tasks import CASH_FLOW_CSV, LOAN_CSV
+
+
+class StatisticsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+
+    def test_loan_totals(self):
+        with self.assertNumQueries(1):
+            totals = loan_totals()
+
+        self.assertEqual(
+            totals,
+            [
+                {"identifier": "L101", "invested_amount": 100000, "repaid_amount": 124000},
+                {"identifier": "L102", "invested_amount": 55000, "repaid_amount": 55030},
+                {"identifier": "L103", "invested_amount": 76000, "repaid_amount": 0},
+            ],
+        )
+
+    def test_loan_totals_by_investment_date(self):
+        totals = loan_totals(start=date(2021, 6, 1), end=date(2021, 6, 30))
+
+        self.assertEqual([total["identifier"] for total in totals], ["L102"])
+
+    def test_cumulative_series_by_month(self):
+        with self.assertNumQueries(1):
+            series = cumulative_series("month")
+
+        self.assertEqual(
+            series,
+            [
+                {"date": "2021-05-01", "invested_amount": 100000, "repaid_amount": 0},
+                {"date": "2021-06-01", "invested_amount": 155000, "repaid_amount": 0},
+                {"date": "2021-07-01", "invested_amount": 231000, "repaid_amount": 0},
+                {"date": "2021-09-01", "invested_amount": 231000, "repaid_amount": 124000},
+                {"date": "2021-10-01", "invested_amount": 231000, "repaid_amount": 179030},
+            ],
+        )
+
+    def test_cumulative_series_date_range(self):
+        series = cumulative_series(
+            "day", start=date(2021, 6, 10), end=date(2021, 9, 30)
+        )
+
+        self.assertEqual(
+            series,
+            [
+                {"date": "2021-07-04", "invested_amount": 231000, "repaid_amount": 0},
+                {"date": "2021-09-10", "invested_amount": 231000, "repaid_amount": 124000},
+            ],
+        )
+
+    def test_series_view(self):
+        client = APIClient()
+        client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+        response = client.get("/statistics/series/", {"bucket": "week"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["bucket"], "week")
+        self.assertEqual(len(response.data["loans"]), 3)
+        self.assertEqual(response.data["series"][0]["date"], "2021-04-26")
+
+        response = client.get("/statistics/series/", {"bucket": "year"})
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get("/statistics/series/", {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SingleFlightTestCase(TestCase):
+    namespace = "single-flight-test"
+
+    def setUp(self):
+        cache.clear()
+        self.computed = []
+
+    def compute(self, value):
+        def compute():
+            self.computed.append(value)
+            return value
+
+        return compute
+
+    def lock_key(self):
+        return versioned_key(self.namespace, "value", "lock")
+
+    def test_cached_per_data_version(self):
+        version = get_data_version(self.namespace)
+        self.assertEqual(
+            single_flight(self.namespace, "value", self.compute(1)), (1, version)
+        )
+        self.assertEqual(
+            single_flight(self.namespace, "value", self.compute(2)), (1, version)
+        )
+
+        bump_data_version(self.namespace)
+
+        self.assertEqual(
+            single_flight(self.namespace, "value", self.compute(3)), (3, version + 1)
+        )
+        self.assertEqual(self.computed, [1, 3])
+
+    def test_stale_value_served_during_recomputation(self):
+        _, version = single_flight(self.namespace, "value", self.compute(1))
+        bump_data_version(self.namespace)
+        cache.add(self.lock_key(), True)
+
+        # With the version it was computed for, not the current one.
+        self.assertEqual(
+            single_flight(self.namespace, "value", self.compute(2)), (1, version)
+        )
+        self.assertEqual(self.computed, [1])
+
+    def test_gives_up_waiting_without_stale_value(self):
+        cache.add(self.lock_key(), True)
+
+        value, _ = single_flight(self.namespace, "value", self.compute(1), wait=0.1)
+
+        self.assertEqual(value, 1)
+        self.assertEqual(self.computed, [1])
+
+    def test_prewarm(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        client = APIClient()
+        client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+        prewarm_statistics_cache()
+
+        with self.assertNumQueries(0):
+            response = client.get("/statistics/basic/")
+            client.get("/statistics/series/", {"bucket": "month"})
+        self.assertEqual(response.data["number_of_loans"], 3)
+
+    def test_data_change_queues_prewarm(self):
+        with mock.patch.object(render_statistics_charts, "delay"):
+            with mock.patch.object(prewarm_statistics_cache, "delay") as delay:
+                bump_data_version(STATISTICS)
+
+        delay.assert_called_once_with()
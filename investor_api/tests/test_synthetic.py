@@ -0,0 +1,81 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command
+from django.test import TestCase
+from investor_api.models import CashFlow, Loan
+from investor_api.synthetic import PortfolioGenerator
+from investor_api.tasks import process_csv
+
+
+class PortfolioGeneratorTests(TestCase):
+    def write(self, generator):
+        loan_csv, cash_flow_csv = StringIO(), StringIO()
+        counts = generator.write_csv(loan_csv, cash_flow_csv)
+        return loan_csv.getvalue(), cash_flow_csv.getvalue(), counts
+
+    def test_same_seed_same_portfolio(self):
+        first = self.write(PortfolioGenerator(50, seed=7))
+        self.assertEqual(first, self.write(PortfolioGenerator(50, seed=7)))
+        self.assertNotEqual(first, self.write(PortfolioGenerator(50, seed=8)))
+
+    def test_mixes(self):
+        generator = PortfolioGenerator(
+            30, rating_mix={9: 1}, pattern_mix={"unfunded": 1}
+        )
+        loans = list(generator)
+
+        self.assertEqual({loan["rating"] for loan, _ in loans}, {9})
+        self.assertEqual([cash_flows for _, cash_flows in loans], [[]] * 30)
+
+        with self.assertRaises(ValueError):
+            PortfolioGenerator(10, rating_mix={10: 1})
+        with self.assertRaises(ValueError):
+            PortfolioGenerator(10, pattern_mix={"bullet": 0})
+
+    def test_portfolio_can_be_imported(self):
+        loan_csv, cash_flow_csv, (loans, cash_flows) = self.write(
+            PortfolioGenerator(200, pattern_mix={"amortizing": 1, "default": 1})
+        )
+
+        process_csv(loan_csv, cash_flow_csv)
+
+        self.assertEqual(Loan.objects.count(), loans)
+        self.assertEqual(CashFlow.objects.count(), cash_flows)
+        # Loans issued long enough ago are repaid, defaulted ones never are.
+        self.assertTrue(Loan.objects.filter(is_closed=True).exists())
+        self.assertTrue(Loan.objects.filter(is_closed=False).exists())
+
+
+class RunBenchmarksCommandTests(TestCase):
+    def test_writes_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            call_command(
+                "run_benchmarks",
+                sizes="5,10",
+                repeat=1,
+                label="test",
+                output=str(output),
+                stdout=StringIO(),
+            )
+            report = json.loads(output.read_text())
+
+        self.assertEqual(report["label"], "test")
+        self.assertEqual([result["loans"] for result in report["results"]], [5, 10])
+        benchmarks = report["results"][0]["benchmarks"]
+        self.assertEqual(
+            set(benchmarks),
+            {
+                "import_job",
+                "recalculate_metrics",
+                "statistics",
+                "statistics_charts",
+                "loan_list",
+                "cash_flow_list",
+            },
+        )
+        self.assertEqual(benchmarks["statistics"]["queries"], 1)
+        self.assertGreater(benchmarks["import_job"]["peak_memory_bytes"], 0)
+        self.assertFalse(Loan.objects.exists())
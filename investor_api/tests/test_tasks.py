@@ -0,0 +1,425 @@
+import csv
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from investor_api.caching import (
+    STATISTICS,
+    get_data_version,
+    get_rendered_charts,
+)
+from investor_api.imports import import_cash_flow_chunk
+from investor_api.models import CashFlow, ImportJob, Loan, PortfolioAggregate
+from investor_api.services import recalculate_loan_metrics
+from investor_api.staging import StagedFileError, purge_staged_files, stage_upload
+from investor_api.tasks import (
+    finish_import_job,
+    process_csv,
+    render_statistics_charts,
+    run_import_job,
+    run_import_shard,
+)
+
+
+LOAN_CSV = """identifier,issue_date,total_amount,rating,maturity_date,total_expected_interest_amount
+L101,2021-05-01,100000,1,2021-09-01,24000
+L102,2021-06-01,55000,3,2021-10-01,30
+L103,2021-07-01,100000,2,2021-12-01,50
+"""
+
+CASH_FLOW_CSV = """loan_identifier,reference_date,type,amount
+L101,2021-05-01,Funding,-100000
+L102,2021-06-03,Funding,-55000
+L103,2021-07-04,Funding,-76000
+L101,2021-09-10,Repayment,124000
+L102,2021-10-03,Repayment,55030
+"""
+
+
+class ProcessCsvTestCase(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool_dir = Path(spool.name)
+        settings_override = override_settings(CSV_SPOOL_DIR=self.spool_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_process_csv(self):
+        job = ImportJob.objects.get(pk=process_csv(LOAN_CSV, CASH_FLOW_CSV))
+
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(CashFlow.objects.count(), 5)
+
+        loan = Loan.objects.get(identifier="L103")
+        self.assertEqual(loan.invested_amount, 76000)
+        self.assertEqual(loan.expected_interest_amount, 38)
+        self.assertFalse(loan.is_closed)
+        self.assertIsNotNone(loan.expected_irr)
+        self.assertIsNone(loan.realized_irr)
+
+        loan = Loan.objects.get(identifier="L102")
+        self.assertTrue(loan.is_closed)
+        self.assertIsNotNone(loan.realized_irr)
+
+    def test_process_csv_updates_portfolio_aggregate(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+
+        aggregate = PortfolioAggregate.load()
+        self.assertEqual(aggregate.loan_count, 3)
+        self.assertEqual(aggregate.total_invested_amount, 231000)
+        self.assertEqual(aggregate.current_invested_amount, 76000)
+        self.assertEqual(aggregate.total_repaid_amount, 179030)
+        rebuilt = PortfolioAggregate.rebuild()
+        self.assertAlmostEqual(
+            aggregate.average_realized_irr, rebuilt.average_realized_irr
+        )
+
+    def test_process_csv_in_small_batches(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV, batch_size=2)
+
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(
+            CashFlow.objects.filter(loan_identifier="L101").count(), 2
+        )
+
+    def test_process_csv_records_unknown_loan(self):
+        cash_flow_csv = CASH_FLOW_CSV + "L999,2021-10-03,Repayment,10\n"
+
+        job = ImportJob.objects.get(pk=process_csv(LOAN_CSV, cash_flow_csv))
+
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(
+            [(error["file"], error["row"]) for error in job.errors],
+            [("cash_flow.csv", 6)],
+        )
+        self.assertEqual(CashFlow.objects.count(), 5)
+
+
+class ImportJobTestCase(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool_dir = Path(spool.name)
+        settings_override = override_settings(
+            CSV_SPOOL_DIR=self.spool_dir, CSV_IMPORT_SHARDS=1
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stage(self, name, content, compress=None):
+        return stage_upload(SimpleUploadedFile(name, content.encode()), compress)
+
+    def create_job(self, loan_csv=LOAN_CSV, cash_flow_csv=CASH_FLOW_CSV, compress=None):
+        return ImportJob.objects.create(
+            loan_csv=self.stage("loans.csv", loan_csv, compress),
+            cash_flow_csv=self.stage("cash_flow.csv", cash_flow_csv, compress),
+        )
+
+    def test_run_import_job(self):
+        for compress in (True, False):
+            with self.subTest(compress=compress):
+                job = self.create_job(compress=compress)
+                self.assertEqual(len(list(self.spool_dir.iterdir())), 2)
+
+                run_import_job(job.id, batch_size=2)
+
+                job.refresh_from_db()
+                self.assertEqual(job.status, ImportJob.SUCCEEDED)
+                self.assertEqual(job.phase, ImportJob.DONE)
+                self.assertEqual(job.rows_processed, 8)
+                self.assertEqual(job.loans_recalculated, 3)
+                self.assertEqual(job.error_count, 0)
+                self.assertEqual(Loan.objects.count(), 3)
+                self.assertEqual(CashFlow.objects.count(), 5)
+                self.assertTrue(Loan.objects.get(identifier="L102").is_closed)
+                self.assertEqual(list(self.spool_dir.iterdir()), [])
+                Loan.objects.all().delete()
+
+    def test_invalid_rows_are_recorded_and_skipped(self):
+        job = self.create_job(
+            LOAN_CSV + "L104,2021-07-01,100,12,2021-12-01,5\nL101,2021-05-01,1,1,2021-09-01,1\n",
+            CASH_FLOW_CSV + "L999,2021-10-03,Repayment,10\nL103,not a date,Repayment,10\n",
+        )
+
+        run_import_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(job.rows_processed, 12)
+        self.assertEqual(job.error_count, 4)
+        self.assertEqual(
+            [(error["file"], error["row"], list(error["errors"])) for error in job.errors],
+            [
+                ("loans.csv", 4, ["rating"]),
+                ("loans.csv", 5, ["identifier"]),
+                ("cash_flow.csv", 6, ["loan_identifier"]),
+                ("cash_flow.csv", 7, ["reference_date"]),
+            ],
+        )
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(CashFlow.objects.count(), 5)
+        self.assertEqual(PortfolioAggregate.load().total_repaid_amount, 179030)
+
+    def test_resume_from_checkpoint(self):
+        job = self.create_job()
+
+        chunks = []
+
+        def crash_after_first_chunk(rows, upsert):
+            if chunks:
+                raise RuntimeError("Worker lost.")
+            chunks.append(rows)
+            return import_cash_flow_chunk(rows, upsert)
+
+        with mock.patch(
+            "investor_api.imports.import_cash_flow_chunk",
+            side_effect=crash_after_first_chunk,
+        ):
+            with self.assertRaises(RuntimeError):
+                run_import_job(job.id, batch_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(job.phase, ImportJob.CASH_FLOWS)
+        self.assertEqual(job.loan_rows_processed, 3)
+        self.assertEqual(job.cash_flow_rows_processed, 2)
+        self.assertEqual(CashFlow.objects.count(), 2)
+
+        run_import_job(job.id, batch_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(job.cash_flow_rows_processed, 5)
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(CashFlow.objects.count(), 5)
+        self.assertEqual(PortfolioAggregate.load().total_repaid_amount, 179030)
+
+    def test_corrupted_staged_file_fails_the_job(self):
+        job = self.create_job()
+        job.cash_flow_csv["sha256"] = "0" * 64
+        job.save()
+
+        with self.assertRaises(StagedFileError):
+            run_import_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn("corrupted", job.message)
+        self.assertEqual(Loan.objects.count(), 0)
+        self.assertEqual(len(list(self.spool_dir.iterdir())), 2)
+
+    def test_upsert_skips_unchanged_rows(self):
+        run_import_job(self.create_job().id)
+        job = self.create_job(
+            LOAN_CSV + "L104,2021-07-01,1000,2,2021-12-01,50\n",
+            CASH_FLOW_CSV.replace("124000", "125000")
+            + "L104,2021-07-04,Funding,-1000\n",
+        )
+        job.mode = ImportJob.UPSERT
+        job.save()
+
+        with mock.patch(
+            "investor_api.imports.recalculate_loan_metrics",
+            wraps=recalculate_loan_metrics,
+        ) as recalculate:
+            run_import_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(job.rows_unchanged, 7)
+        self.assertEqual(job.error_count, 0)
+        self.assertEqual(
+            [loan.identifier for loan in recalculate.call_args.args[0]], ["L101", "L104"]
+        )
+        self.assertEqual(Loan.objects.count(), 4)
+        self.assertEqual(CashFlow.objects.count(), 6)
+        self.assertEqual(
+            CashFlow.objects.get(loan_identifier="L101", type="Repayment").amount, 125000
+        )
+        self.assertFalse(Loan.objects.filter(metrics_stale=True).exists())
+        aggregate = PortfolioAggregate.load()
+        self.assertEqual(aggregate.total_repaid_amount, 180030)
+        self.assertAlmostEqual(
+            aggregate.average_realized_irr,
+            PortfolioAggregate.rebuild().average_realized_irr,
+        )
+
+    def create_upsert_job(self, cash_flow_csv):
+        job = self.create_job(cash_flow_csv=cash_flow_csv)
+        job.mode = ImportJob.UPSERT
+        job.save()
+        return job
+
+    def repayments_of_l102(self):
+        return list(
+            CashFlow.objects.filter(loan_identifier="L102", type="Repayment")
+            .order_by("pk")
+            .values_list("amount", flat=True)
+        )
+
+    def test_upsert_keeps_cash_flows_with_the_same_key(self):
+        same_day = CASH_FLOW_CSV.replace(
+            "L102,2021-10-03,Repayment,55030\n",
+            "L102,2021-10-03,Repayment,300\nL102,2021-10-03,Repayment,200\n",
+        )
+
+        run_import_job(self.create_upsert_job(same_day).id, batch_size=1)
+        self.assertEqual(self.repayments_of_l102(), [300, 200])
+
+        job = self.create_upsert_job(same_day)
+        run_import_job(job.id, batch_size=1)
+        job.refresh_from_db()
+        self.assertEqual(job.rows_unchanged, 9)
+        self.assertEqual(self.repayments_of_l102(), [300, 200])
+
+        job = self.create_upsert_job(same_day.replace(",200\n", ",250\n"))
+        run_import_job(job.id, batch_size=1)
+        self.assertEqual(self.repayments_of_l102(), [300, 250])
+        self.assertEqual(PortfolioAggregate.load().total_repaid_amount, 124550)
+
+    def test_upsert_after_create_with_the_same_key(self):
+        same_day = CASH_FLOW_CSV.replace(
+            "L102,2021-10-03,Repayment,55030\n",
+            "L102,2021-10-03,Repayment,300\nL102,2021-10-03,Repayment,200\n",
+        )
+        run_import_job(self.create_job(cash_flow_csv=same_day).id)
+
+        job = self.create_upsert_job(same_day)
+        run_import_job(job.id, batch_size=1)
+        job.refresh_from_db()
+        self.assertEqual((job.error_count, job.rows_unchanged), (0, 9))
+        self.assertEqual(self.repayments_of_l102(), [300, 200])
+
+        # Chunks called on their own number the rows themselves.
+        errors, unchanged = import_cash_flow_chunk(
+            list(enumerate(csv.DictReader(StringIO(same_day)), start=1)), upsert=True
+        )
+        self.assertEqual((errors, unchanged), ([], 6))
+        self.assertEqual(self.repayments_of_l102(), [300, 200])
+
+    def test_create_rejects_existing_loans(self):
+        run_import_job(self.create_job().id)
+        job = self.create_job(
+            cash_flow_csv="loan_identifier,reference_date,type,amount\n"
+        )
+
+        run_import_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.error_count, 3)
+        self.assertEqual(
+            job.errors[0]["errors"],
+            {"identifier": ["Loan with this identifier already exists."]},
+        )
+
+    @override_settings(CSV_IMPORT_SHARDS=4)
+    def test_sharded_import(self):
+        job = self.create_job(
+            cash_flow_csv=CASH_FLOW_CSV + "L999,2021-10-03,Repayment,10\n"
+        )
+        version = get_data_version(STATISTICS)
+
+        with mock.patch("investor_api.tasks.chord") as chord:
+            run_import_job(job.id)
+
+        job.refresh_from_db()
+        shards = list(job.shards.all())
+        self.assertEqual(job.phase, ImportJob.SHARDS)
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(len(list(chord.call_args.args[0])), 4)
+
+        for shard in shards:
+            run_import_shard(shard.id)
+        self.assertEqual(Loan.objects.count(), 3)
+        self.assertEqual(CashFlow.objects.count(), 5)
+        self.assertEqual(get_data_version(STATISTICS), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            finish_import_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(job.rows_processed, 9)
+        self.assertEqual(job.loans_recalculated, 4)
+        self.assertEqual(
+            [(error["file"], error["row"]) for error in job.errors],
+            [("cash_flow.csv", 6)],
+        )
+        self.assertTrue(Loan.objects.get(identifier="L102").is_closed)
+        self.assertEqual(PortfolioAggregate.load().total_repaid_amount, 179030)
+        self.assertEqual(PortfolioAggregate.load().current_invested_amount, 76000)
+        self.assertGreater(get_data_version(STATISTICS), version)
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+    @override_settings(CSV_IMPORT_SHARDS=2)
+    def test_failed_shard_fails_the_import(self):
+        job = self.create_job()
+        with mock.patch("investor_api.tasks.chord"):
+            run_import_job(job.id)
+        shard = job.shards.first()
+
+        with mock.patch(
+            "investor_api.imports._recalculate_metrics",
+            side_effect=RuntimeError("Database is gone."),
+        ):
+            with self.assertRaises(RuntimeError):
+                run_import_shard(shard.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(job.message, "Shard 0 failed: Database is gone.")
+
+    def test_purge_staged_files(self):
+        self.stage("loans.csv", LOAN_CSV)
+
+        self.assertEqual(purge_staged_files(max_age=60), 0)
+        self.assertEqual(purge_staged_files(max_age=-1), 1)
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+    def test_purge_keeps_files_of_unfinished_imports(self):
+        job = self.create_job()
+
+        for status in (ImportJob.PENDING, ImportJob.RUNNING):
+            job.status = status
+            job.save()
+            self.assertEqual(purge_staged_files(max_age=-1), 0)
+            self.assertEqual(len(list(self.spool_dir.iterdir())), 2)
+
+        job.status = ImportJob.FAILED
+        job.save()
+        self.assertEqual(purge_staged_files(max_age=-1), 2)
+
+
+class StatisticsChartsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+
+    def test_chart_view_schedules_rendering(self):
+        with mock.patch.object(render_statistics_charts, "delay") as delay:
+            response = self.client.get("/statistics/chart/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Charts are being rendered.")
+        delay.assert_called_once_with(get_data_version(STATISTICS))
+
+    def test_chart_view_serves_rendered_charts(self):
+        render_statistics_charts(get_data_version(STATISTICS))
+
+        charts, is_current = get_rendered_charts()
+        self.assertTrue(is_current)
+        self.assertTrue(charts["investment_distribution"].startswith("data:image/png"))
+
+        with mock.patch.object(render_statistics_charts, "delay") as delay:
+            response = self.client.get("/statistics/chart/")
+
+        self.assertContains(response, charts["investment_over_time"])
+        self.assertNotContains(response, "Charts are being")
+        delay.assert_not_called()
@@ -0,0 +1,645 @@
+import hashlib
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from investor_api import metrics
+from investor_api.authentication import RoleTokenObtainPairSerializer
+from investor_api.caching import (
+    CASH_FLOW_NAMESPACES,
+    STATISTICS,
+    bump_data_version,
+    versioned_key,
+)
+from investor_api.exports import encode
+from investor_api.models import (
+    CashFlow,
+    CustomUser,
+    ImportJob,
+    Loan,
+    PortfolioAggregate,
+)
+from investor_api.serializers import CashFlowSerializer, LoanDetailSerializer
+from investor_api.services import recalculate_loan_metrics
+from investor_api.tasks import process_csv, run_import_job
+from investor_api.tests.test_tasks import CASH_FLOW_CSV, LOAN_CSV
+
+
+class LoanListTestCase(TestCase):
+    def setUp(self):
+        # Loan details cached by other tests can match these loan ids.
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+    def test_list_loans_paginated(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/loans/", {"page_size": 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [loan["identifier"] for loan in response.data["results"]], ["L101", "L102"]
+        )
+        self.assertEqual(len(response.data["results"][0]["cash_flows"]), 2)
+        self.assertIsNone(response.data["previous"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [loan["identifier"] for loan in response.data["results"]], ["L103"]
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_list_loans_ordering(self):
+        response = self.client.get("/loans/", {"ordering": "-identifier"})
+
+        self.assertEqual(
+            [loan["identifier"] for loan in response.data["results"]],
+            ["L103", "L102", "L101"],
+        )
+
+    def test_list_loans_filtered(self):
+        response = self.client.get("/loans/", {"identifier": "L103"})
+
+        self.assertEqual(
+            [loan["identifier"] for loan in response.data["results"]], ["L103"]
+        )
+
+    def test_list_loans_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/loans/", {"fields": "identifier,rating,expected_irr"}
+            )
+
+        self.assertEqual(
+            set(response.data["results"][0]), {"identifier", "rating", "expected_irr"}
+        )
+
+    def test_list_loans_sparse_fields_with_cash_flows(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/loans/", {"fields": "identifier", "include": "cash_flows"}
+            )
+
+        self.assertEqual(set(response.data["results"][0]), {"identifier", "cash_flows"})
+        self.assertEqual(len(response.data["results"][0]["cash_flows"]), 2)
+
+    def test_list_loans_unknown_fields(self):
+        response = self.client.get("/loans/", {"fields": "identifier,secret"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(
+            "/loans/", {"fields": "identifier", "include": "borrower"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_loan_detail_sparse_fields(self):
+        loan = Loan.objects.get(identifier="L102")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/loans/%s/" % loan.pk, {"fields": "identifier,is_closed"}
+            )
+
+        self.assertEqual(response.data, {"identifier": "L102", "is_closed": True})
+
+
+class CashFlowListTestCase(TestCase):
+    def setUp(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+    def test_list_cash_flows_paginated(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/cashflows/", {"page_size": 3})
+
+        self.assertEqual(len(response.data["results"]), 3)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+    def test_export_loans_matches_serializer(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/loans/export/")
+            content = b"".join(response.streaming_content)
+
+        queryset = Loan.objects.order_by("pk").prefetch_related("cash_flows")
+        self.assertEqual(
+            content,
+            JSONRenderer().render(LoanDetailSerializer(queryset, many=True).data),
+        )
+
+    def test_export_loans_sparse_fields_filtered(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/loans/export/", {"fields": "identifier,rating", "rating": 3}
+            )
+            content = b"".join(response.streaming_content)
+
+        self.assertEqual(
+            json.loads(content),
+            list(Loan.objects.filter(rating=3).values("identifier", "rating")),
+        )
+
+    def test_export_cash_flows_matches_serializer(self):
+        response = self.client.get("/cashflows/export/", {"loan_identifier": "L101"})
+        content = b"".join(response.streaming_content)
+
+        queryset = CashFlow.objects.filter(loan_identifier="L101").order_by("pk")
+        self.assertEqual(
+            content,
+            JSONRenderer().render(CashFlowSerializer(queryset, many=True).data),
+        )
+
+    def test_encode_matches_json_renderer(self):
+        data = {"name": "caf\u00e9 \u2028\u2029", "amount": 1.5, "flags": [True, None]}
+
+        self.assertEqual(encode(data), JSONRenderer().render(data))
+
+
+class CsvUploadTestCase(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool_dir = Path(spool.name)
+        settings_override = override_settings(
+            CSV_SPOOL_DIR=self.spool_dir, CSV_IMPORT_SHARDS=1
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="investor", is_investor=True)
+        )
+
+    def test_upload_stages_files(self):
+        with mock.patch.object(run_import_job, "delay") as delay:
+            response = self.client.post(
+                "/csv/upload/",
+                {
+                    "loans.csv": SimpleUploadedFile("loans.csv", LOAN_CSV.encode()),
+                    "cash_flow.csv": SimpleUploadedFile(
+                        "cash_flow.csv", CASH_FLOW_CSV.encode()
+                    ),
+                },
+            )
+
+        self.assertEqual(response.status_code, 200)
+        job = ImportJob.objects.get(pk=response.data["job"])
+        delay.assert_called_once_with(job.id)
+        loan_csv, cash_flow_csv = job.loan_csv, job.cash_flow_csv
+        self.assertEqual(
+            loan_csv["sha256"], hashlib.sha256(LOAN_CSV.encode()).hexdigest()
+        )
+        self.assertEqual(
+            {path.name for path in self.spool_dir.iterdir()},
+            {loan_csv["name"], cash_flow_csv["name"]},
+        )
+
+    def test_upload_discards_files_when_queueing_fails(self):
+        with mock.patch.object(
+            run_import_job, "delay", side_effect=ConnectionError
+        ):
+            response = self.client.post(
+                "/csv/upload/",
+                {
+                    "loans.csv": SimpleUploadedFile("loans.csv", LOAN_CSV.encode()),
+                    "cash_flow.csv": SimpleUploadedFile(
+                        "cash_flow.csv", CASH_FLOW_CSV.encode()
+                    ),
+                },
+            )
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+        self.assertEqual(ImportJob.objects.get().status, ImportJob.FAILED)
+
+    def test_upload_mode(self):
+        files = {
+            "loans.csv": SimpleUploadedFile("loans.csv", LOAN_CSV.encode()),
+            "cash_flow.csv": SimpleUploadedFile("cash_flow.csv", CASH_FLOW_CSV.encode()),
+        }
+        with mock.patch.object(run_import_job, "delay"):
+            response = self.client.post("/csv/upload/", {**files, "mode": "upsert"})
+        self.assertEqual(ImportJob.objects.get().mode, ImportJob.UPSERT)
+
+        response = self.client.post("/csv/upload/", {**files, "mode": "replace"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_job_status(self):
+        with mock.patch.object(run_import_job, "delay"):
+            response = self.client.post(
+                "/csv/upload/",
+                {
+                    "loans.csv": SimpleUploadedFile("loans.csv", LOAN_CSV.encode()),
+                    "cash_flow.csv": SimpleUploadedFile(
+                        "cash_flow.csv", CASH_FLOW_CSV.encode()
+                    ),
+                },
+            )
+        job_url = "/csv/jobs/%s/" % response.data["job"]
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.data["status"], ImportJob.PENDING)
+        self.assertIsNone(response.data["rows_per_second"])
+
+        run_import_job(ImportJob.objects.get().id)
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], ImportJob.SUCCEEDED)
+        self.assertEqual(response.data["phase"], ImportJob.DONE)
+        self.assertEqual(response.data["rows_processed"], 8)
+        self.assertEqual(response.data["errors"], [])
+
+        self.assertEqual(self.client.get("/csv/jobs/999/").status_code, 404)
+
+
+class CashFlowBulkCreateTestCase(TestCase):
+    def setUp(self):
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="investor", is_investor=True)
+        )
+
+    def test_bulk_create_recalculates_each_loan_once(self):
+        repaid_amount = PortfolioAggregate.load().total_repaid_amount
+
+        with mock.patch(
+            "investor_api.views.recalculate_loan_metrics",
+            wraps=recalculate_loan_metrics,
+        ) as recalculate:
+            response = self.client.post(
+                "/cashflows/bulk/",
+                [
+                    {"loan_identifier": "L103", "reference_date": "2021-10-01",
+                     "type": "Repayment", "amount": 40000},
+                    {"loan_identifier": "L103", "reference_date": "2021-11-01",
+                     "type": "Repayment", "amount": 36038},
+                ],
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [cash_flow["loan_identifier"] for cash_flow in response.data], ["L103", "L103"]
+        )
+        recalculate.assert_called_once()
+        self.assertEqual(
+            [loan.identifier for loan in recalculate.call_args.args[0]], ["L103"]
+        )
+        loan = Loan.objects.get(identifier="L103")
+        self.assertTrue(loan.is_closed)
+        self.assertIsNotNone(loan.realized_irr)
+        self.assertEqual(
+            PortfolioAggregate.load().total_repaid_amount, repaid_amount + 76038
+        )
+
+    def test_bulk_create_validates_every_row(self):
+        response = self.client.post(
+            "/cashflows/bulk/",
+            [
+                {"loan_identifier": "L103", "reference_date": "2021-10-01",
+                 "type": "Repayment", "amount": 10},
+                {"loan_identifier": "L999", "reference_date": "2021-10-01",
+                 "type": "Repayment", "amount": 10},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("loan_identifier", response.data[1])
+        self.assertEqual(CashFlow.objects.count(), 5)
+
+        response = self.client.post(
+            "/cashflows/bulk/",
+            [{"loan_identifier": "L103", "reference_date": "2021-10-01",
+              "type": "Refund", "amount": 10}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("type", response.data[0])
+
+        response = self.client.post(
+            "/cashflows/bulk/", {"loan_identifier": "L103"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        for histogram in metrics.HISTOGRAMS:
+            histogram.reset()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+    def test_requests_are_recorded(self):
+        self.client.get("/loans/")
+        self.client.get("/loans/")
+
+        admin_client = Client()
+        admin_client.force_login(
+            CustomUser.objects.create(username="admin", is_staff=True)
+        )
+        response = admin_client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        body = response.content.decode()
+        self.assertIn(
+            'investor_api_request_duration_seconds_count{view="investor_api.views.LoanList",'
+            'method="GET",status="200"} 2',
+            body,
+        )
+        self.assertIn(
+            'investor_api_request_queries_bucket{view="investor_api.views.LoanList",'
+            'method="GET",le="2"} 2',
+            body,
+        )
+        self.assertIn(
+            'investor_api_csv_import_phase_duration_seconds_count{task="import_job",'
+            'phase="cash_flows"} 1',
+            body,
+        )
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get("/loans/")
+
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries"$',
+        )
+
+    @override_settings(METRICS_SERVER_TIMING=False)
+    def test_no_server_timing_header_by_default(self):
+        self.assertNotIn("Server-Timing", self.client.get("/loans/"))
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_are_for_admins(self):
+        self.assertEqual(Client().get("/metrics").status_code, 401)
+
+        analyst = CustomUser.objects.get(username="analyst")
+        token = RoleTokenObtainPairSerializer.get_token(analyst).access_token
+        response = Client().get("/metrics", HTTP_AUTHORIZATION="Bearer %s" % token)
+        self.assertEqual(response.status_code, 401)
+
+        admin = CustomUser.objects.create(username="admin", is_staff=True)
+        token = RoleTokenObtainPairSerializer.get_token(admin).access_token
+        response = Client().get("/metrics", HTTP_AUTHORIZATION="Bearer %s" % token)
+        self.assertEqual(response.status_code, 200)
+
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(Client().get("/metrics").status_code, 200)
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        # Token revocations recorded by other tests can match these user ids.
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.admin = CustomUser.objects.create(username="admin", is_staff=True)
+        self.analyst = CustomUser.objects.create(username="analyst", is_analyst=True)
+
+    def get(self, user, path, **extra):
+        token = RoleTokenObtainPairSerializer.get_token(user).access_token
+        return self.client.get(path, HTTP_AUTHORIZATION="Bearer %s" % token, **extra)
+
+    def test_admin_profiles_a_request(self):
+        response = self.get(self.admin, "/loans/?rating=1&profile=1")
+
+        self.assertEqual(response.status_code, 200)
+        profile_id = response["X-Profile-Id"]
+        profile = self.get(self.admin, "/profiles/%s/" % profile_id).json()
+        self.assertEqual(profile["path"], "/loans/?rating=1&profile=1")
+        self.assertEqual(profile["view"], "investor_api.views.LoanList")
+        self.assertEqual(profile["sql"]["count"], 2)
+        self.assertIn(
+            "investor_api/views.py",
+            "".join(function["function"] for function in profile["functions"]),
+        )
+
+    def test_profile_header(self):
+        response = self.get(self.admin, "/statistics/basic/", HTTP_X_PROFILE="1")
+
+        self.assertIn("X-Profile-Id", response)
+
+    def test_only_admins_are_profiled(self):
+        self.assertNotIn("X-Profile-Id", self.get(self.analyst, "/loans/?profile=1"))
+        self.assertNotIn("X-Profile-Id", self.client.get("/loans/?profile=1"))
+        self.assertNotIn("X-Profile-Id", self.get(self.admin, "/loans/"))
+
+    def test_profiles_are_admin_only(self):
+        profile_id = self.get(self.admin, "/loans/?profile=1")["X-Profile-Id"]
+
+        response = self.get(self.analyst, "/profiles/%s/" % profile_id)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.get(self.admin, "/profiles/missing/").status_code, 404)
+
+
+class ConditionalGetTestCase(TestCase):
+    paths = ["/loans/", "/cashflows/", "/statistics/basic/"]
+
+    def setUp(self):
+        cache.clear()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        # What committing the import does.
+        bump_data_version(*CASH_FLOW_NAMESPACES)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+
+    def test_not_modified_without_queries(self):
+        for path in self.paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+
+            with self.assertNumQueries(0):
+                cached = self.client.get(path, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(cached.status_code, 304)
+            self.assertNotIn("Last-Modified", response)
+
+    def test_etag_changes_with_the_data(self):
+        etags = {path: self.client.get(path)["ETag"] for path in self.paths}
+
+        CashFlow.objects.create(
+            loan_identifier=Loan.objects.get(identifier="L103"),
+            reference_date="2021-12-01",
+            type="Repayment",
+            amount=100,
+        )
+        bump_data_version(*CASH_FLOW_NAMESPACES)
+
+        for path in self.paths:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etags[path])
+
+    def test_stale_statistics_keep_their_etag(self):
+        path = "/statistics/basic/"
+        etag = self.client.get(path)["ETag"]
+
+        bump_data_version(STATISTICS)
+        # Another worker is recomputing the statistics of the new version.
+        cache.add(versioned_key(STATISTICS, "basic", "lock"), True)
+
+        stale = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale["ETag"], etag)
+
+        cache.delete(versioned_key(STATISTICS, "basic", "lock"))
+        current = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(current.status_code, 200)
+        self.assertNotEqual(current["ETag"], etag)
+        self.assertEqual(
+            self.client.get(path, HTTP_IF_NONE_MATCH=current["ETag"]).status_code, 304
+        )
+
+    def test_etag_depends_on_the_query(self):
+        self.assertNotEqual(
+            self.client.get("/loans/")["ETag"],
+            self.client.get("/loans/", {"rating": 1})["ETag"],
+        )
+
+
+class ObjectCacheTestCase(TransactionTestCase):
+    """Invalidation happens on commit, so these tests commit for real."""
+
+    def setUp(self):
+        cache.clear()
+        metrics.OBJECT_CACHE_REQUESTS.reset()
+        process_csv(LOAN_CSV, CASH_FLOW_CSV)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="analyst", is_analyst=True)
+        )
+        self.loan = Loan.objects.get(identifier="L101")
+        self.other_loan = Loan.objects.get(identifier="L102")
+
+    def get_loan(self, loan, **params):
+        return self.client.get("/loans/%s/" % loan.pk, params).data
+
+    def test_loan_detail_read_through(self):
+        with self.assertNumQueries(2):
+            data = self.get_loan(self.loan)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_loan(self.loan), data)
+        self.assertEqual(len(data["cash_flows"]), 2)
+
+        # Sparse fieldsets are cached apart, in any order of the fields.
+        with self.assertNumQueries(1):
+            sparse = self.get_loan(self.loan, fields="rating,identifier")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_loan(self.loan, fields="identifier,rating"), sparse)
+        self.assertEqual(sparse, {"identifier": "L101", "rating": data["rating"]})
+
+        self.assertEqual(self.client.get("/loans/0/").status_code, 404)
+
+    def test_cash_flow_write_invalidates_its_loan_on_commit(self):
+        self.get_loan(self.loan)
+        self.get_loan(self.other_loan)
+
+        with transaction.atomic():
+            CashFlow.objects.create(
+                loan_identifier=self.loan,
+                reference_date="2021-12-01",
+                type="Repayment",
+                amount=100,
+            )
+            self.assertEqual(len(self.get_loan(self.loan)["cash_flows"]), 2)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.get_loan(self.loan)["cash_flows"]), 3)
+        with self.assertNumQueries(0):
+            self.get_loan(self.other_loan)
+
+    def test_cash_flow_detail(self):
+        cash_flow = CashFlow.objects.filter(loan_identifier=self.loan).first()
+        path = "/cashflows/%s/" % cash_flow.pk
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(path).data["amount"], cash_flow.amount)
+        self.get_loan(self.loan)
+
+        cash_flow.amount += 1
+        cash_flow.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(path).data["amount"], cash_flow.amount)
+        self.assertEqual(
+            self.get_loan(self.loan)["cash_flows"][0]["amount"], cash_flow.amount
+        )
+
+    def test_bulk_writes_invalidate_their_loans(self):
+        self.get_loan(self.loan)
+        self.get_loan(self.other_loan)
+
+        self.client.force_authenticate(
+            CustomUser.objects.create(username="investor", is_investor=True)
+        )
+        response = self.client.post(
+            "/cashflows/bulk/",
+            [
+                {
+                    "loan_identifier": "L101",
+                    "reference_date": "2021-12-01",
+                    "type": "Repayment",
+                    "amount": 100,
+                }
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(len(self.get_loan(self.loan)["cash_flows"]), 3)
+        with self.assertNumQueries(0):
+            self.get_loan(self.other_loan)
+
+    @override_settings(METRICS_PUBLIC=True)
+    def test_hits_and_misses_are_counted(self):
+        self.get_loan(self.loan)
+        self.get_loan(self.loan)
+        self.get_loan(self.loan)
+
+        body = self.client.get("/metrics").content.decode()
+
+        self.assertIn(
+            'investor_api_object_cache_requests_total{object="loan",result="hit"} 2',
+            body,
+        )
+        self.assertIn(
+            'investor_api_object_cache_requests_total{object="loan",result="miss"} 1',
+            body,
+        )
@@ -1,28 +1,50 @@
-from django.http import Http404
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from investor_api.services import calculate_is_closed
-from .models import Loan, CashFlow, CustomUser
+from rest_framework.exceptions import ValidationError
+from investor_api.services import recalculate_loan_metrics
+from .models import Loan, CashFlow, CustomUser, ImportJob
 from .serializers import (
     LoanDetailSerializer,
+    CashFlowBulkSerializer,
     CashFlowCreateSerializer,
     CashFlowSerializer,
     CustomUserSerializer,
+    ImportJobSerializer,
 )
-from .tasks import process_csv
+from .staging import discard_staged, stage_upload
+from .tasks import run_import_job, schedule_chart_rendering
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum, F, FloatField, ExpressionWrapper
-from django.views.generic import TemplateView
-from django.views.decorators.cache import cache_page
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-import io
-import base64
+from django.utils.crypto import constant_time_compare
+from django.views.generic import TemplateView, View
+from django.db import transaction
+from .exports import cash_flow_rows, loan_rows, stream_json_array
+from . import metrics
+from .profiling import get_profile, is_admin
+from .caching import (
+    CASH_FLOW_OBJECT,
+    CASH_FLOWS,
+    LOAN_OBJECT,
+    LOANS,
+    STATISTICS,
+    cached_object,
+    data_version_condition,
+    data_version_etag,
+    get_rendered_charts,
+)
+from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from .pagination import KeysetPagination
 from .permissions import IsAnalyst, IsInvestor
+from .statistics import (
+    BUCKETS,
+    cached_basic_statistics,
+    cached_series_statistics,
+)
 
 
 class CustomUserList(generics.ListCreateAPIView):
@@ -31,7 +53,52 @@ class CustomUserList(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor)]
 
 
-class LoanList(APIView):
+class LoanFieldsMixin:
+    """Sparse fieldsets for loan endpoints.
+
+    ``?fields=identifier,rating`` limits the rendered fields and the columns
+    loaded, and nested cash flows are only rendered and prefetched when they
+    are requested through ``fields`` or ``?include=cash_flows``. Without
+    ``fields`` every field is rendered, as before.
+    """
+
+    nested_fields = ["cash_flows"]
+
+    def get_loan_fields(self):
+        all_fields = LoanDetailSerializer.Meta.fields
+        fields = self.request.query_params.get("fields")
+        include = self.request.query_params.get("include")
+
+        if not fields:
+            return list(all_fields)
+
+        fields = [field for field in fields.split(",") if field]
+        unknown = set(fields) - set(all_fields)
+        if unknown:
+            raise ValidationError(
+                {"fields": "Unknown fields: %s." % ", ".join(sorted(unknown))}
+            )
+
+        if include:
+            includes = [field for field in include.split(",") if field]
+            unknown = set(includes) - set(self.nested_fields)
+            if unknown:
+                raise ValidationError(
+                    {"include": "Unknown includes: %s." % ", ".join(sorted(unknown))}
+                )
+            fields += [field for field in includes if field not in fields]
+        return fields
+
+    def get_loan_queryset(self, fields):
+        columns = [field for field in fields if field not in self.nested_fields]
+        # The identifier is the target of the cash flows foreign key.
+        queryset = Loan.objects.only("identifier", *columns)
+        if "cash_flows" in fields:
+            queryset = queryset.prefetch_related("cash_flows")
+        return queryset
+
+
+class LoanList(LoanFieldsMixin, APIView):
 
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
 
@@ -51,11 +118,18 @@ class LoanList(APIView):
         "realized_irr",
     ]
 
+    pagination_class = KeysetPagination
+    ordering_fields = ["pk", "identifier"]
+
+    @method_decorator(data_version_condition(LOANS))
     def get(self, request):
-        queryset = Loan.objects.all()
+        fields = self.get_loan_fields()
+        queryset = self.get_loan_queryset(fields)
         filtered_queryset = self.filter_queryset(queryset)
-        serializer = LoanDetailSerializer(filtered_queryset, many=True)
-        return Response(serializer.data)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(filtered_queryset, request, view=self)
+        serializer = LoanDetailSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
 
     def filter_queryset(self, queryset):
         for backend in list(self.filter_backends):
@@ -63,20 +137,37 @@ class LoanList(APIView):
         return queryset
 
 
-class LoanDetail(APIView):
+class LoanExport(LoanList):
+    """Every matching loan as one streamed JSON array, without pagination."""
+
+    def get(self, request):
+        fields = self.get_loan_fields()
+        queryset = self.filter_queryset(Loan.objects.order_by("pk"))
+        return StreamingHttpResponse(
+            stream_json_array(loan_rows(queryset, fields)),
+            content_type="application/json",
+        )
+
+
+class LoanDetail(LoanFieldsMixin, APIView):
 
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
 
-    def get_object(self, pk):
+    def get_object(self, pk, fields):
         try:
-            return Loan.objects.get(pk=pk)
+            return self.get_loan_queryset(fields).get(pk=pk)
         except Loan.DoesNotExist:
             raise Http404
 
     def get(self, request, pk):
-        loan = self.get_object(pk)
-        serializer = LoanDetailSerializer(loan)
-        return Response(serializer.data)
+        fields = self.get_loan_fields()
+
+        def serialize():
+            return LoanDetailSerializer(self.get_object(pk, fields), fields=fields).data
+
+        return Response(
+            cached_object(LOAN_OBJECT, pk, ",".join(sorted(fields)), serialize)
+        )
 
 
 class CashFlowList(APIView):
@@ -99,11 +190,17 @@ class CashFlowList(APIView):
         "loan_identifier",
     ]
 
+    pagination_class = KeysetPagination
+    ordering_fields = ["pk"]
+
+    @method_decorator(data_version_condition(CASH_FLOWS))
     def get(self, request):
         queryset = CashFlow.objects.all()
         filtered_queryset = self.filter_queryset(queryset)
-        serializer = CashFlowSerializer(filtered_queryset, many=True)
-        return Response(serializer.data)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(filtered_queryset, request, view=self)
+        serializer = CashFlowSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def filter_queryset(self, queryset):
         for backend in list(self.filter_backends):
@@ -113,14 +210,75 @@ class CashFlowList(APIView):
     def post(self, request):
         serializer = CashFlowCreateSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
 
-            calculate_is_closed(loan_identifier=serializer.data.get("loan_identifier"))
+                recalculate_loan_metrics(
+                    [Loan.objects.get(identifier=serializer.data.get("loan_identifier"))]
+                )
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CashFlowExport(CashFlowList):
+    """Every matching cash flow as one streamed JSON array, without pagination."""
+
+    http_method_names = ["get", "head", "options"]
+
+    def get(self, request):
+        queryset = self.filter_queryset(CashFlow.objects.order_by("pk"))
+        return StreamingHttpResponse(
+            stream_json_array(cash_flow_rows(queryset)),
+            content_type="application/json",
+        )
+
+
+class CashFlowBulkCreate(APIView):
+    """Create a JSON array of cash flows in one transaction.
+
+    Each affected loan has its metrics recalculated once, whatever the number
+    of its cash flows in the request.
+    """
+
+    permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor)]
+
+    max_cash_flows = 10000
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response(
+                {"message": "Expected a list of cash flows."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > self.max_cash_flows:
+            return Response(
+                {"message": "At most %s cash flows per request." % self.max_cash_flows},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = CashFlowBulkSerializer(
+            data=request.data, many=True, allow_empty=False
+        )
+        if serializer.is_valid():
+            with transaction.atomic():
+                cash_flows = serializer.save()
+
+                recalculate_loan_metrics(
+                    Loan.objects.filter(
+                        identifier__in={
+                            cash_flow.loan_identifier_id for cash_flow in cash_flows
+                        }
+                    ).order_by("pk")
+                )
+
+            return Response(
+                CashFlowSerializer(cash_flows, many=True).data,
+                status=status.HTTP_201_CREATED,
+            )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class CashFlowDetail(APIView):
 
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
@@ -132,9 +290,10 @@ class CashFlowDetail(APIView):
             raise Http404
 
     def get(self, request, pk):
-        cash_flow = self.get_object(pk)
-        serializer = CashFlowSerializer(cash_flow)
-        return Response(serializer.data)
+        def serialize():
+            return CashFlowSerializer(self.get_object(pk)).data
+
+        return Response(cached_object(CASH_FLOW_OBJECT, pk, "all", serialize))
 
 
 class CsvUploadView(APIView):
@@ -151,11 +310,31 @@ class CsvUploadView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        mode = request.data.get("mode", ImportJob.CREATE)
+        if mode not in ImportJob.MODES:
+            return Response(
+                {"message": "mode must be one of: %s." % ", ".join(ImportJob.MODES)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        references = []
+        job = None
         try:
-            process_csv.delay(
-                loan_csv.read().decode("utf-8"), cash_flow_csv.read().decode("utf-8")
+            references.append(stage_upload(loan_csv))
+            references.append(stage_upload(cash_flow_csv))
+            job = ImportJob.objects.create(
+                loan_csv=references[0],
+                cash_flow_csv=references[1],
+                mode=mode,
+                created_by_id=request.user.pk,
             )
+            run_import_job.delay(job.id)
         except:
+            discard_staged(*references)
+            if job is not None:
+                job.status = ImportJob.FAILED
+                job.message = "The import could not be queued."
+                job.save(update_fields=["status", "message", "updated_at"])
             return Response(
                 {
                     "message": "Was not possible start your request right now. Try again later."
@@ -163,57 +342,76 @@ class CsvUploadView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        return Response({"message": "Process started."}, status=status.HTTP_200_OK)
+        return Response(
+            {"message": "Process started.", "job": job.id}, status=status.HTTP_200_OK
+        )
+
+
+class ImportJobDetail(APIView):
+
+    permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor)]
+
+    def get_object(self, pk):
+        try:
+            return ImportJob.objects.get(pk=pk)
+        except ImportJob.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk):
+        job = self.get_object(pk)
+        if job.shard_count and job.status != ImportJob.SUCCEEDED:
+            job.collect_shard_progress()
+        serializer = ImportJobSerializer(job)
+        return Response(serializer.data)
 
 
 class InvestmentStatisticsView(APIView):
 
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
 
-    @method_decorator(cache_page(60 * 15))
+    @method_decorator(data_version_condition(STATISTICS))
     def get(self, request):
         try:
-            loans = Loan.objects.all()
-            number_of_loans = len(loans)
-            total_invested_amount = (
-                loans.aggregate(Sum("invested_amount"))["invested_amount__sum"] or 0
-            )
-            current_invested_amount = (
-                loans.filter(is_closed=False).aggregate(Sum("invested_amount"))[
-                    "invested_amount__sum"
-                ]
-                or 0
-            )
-            total_repaid_amount = (
-                CashFlow.objects.filter(type="Repayment").aggregate(Sum("amount"))[
-                    "amount__sum"
-                ]
-                or 0
-            )
-            weighted_realized_irr = ExpressionWrapper(
-                F("invested_amount") * F("realized_irr"), output_field=FloatField()
-            )
-            average_realized_irr = (
-                loans.filter(is_closed=True)
-                .annotate(weighted_irr=weighted_realized_irr)
-                .aggregate(irr=Sum("weighted_irr") / Sum("invested_amount"))["irr"]
-                or 0
-            )
-
-            response_data = {
-                "number_of_loans": number_of_loans,
-                "total_invested_amount": total_invested_amount,
-                "current_invested_amount": current_invested_amount,
-                "total_repaid_amount": total_repaid_amount,
-                "average_realized_irr": average_realized_irr,
-            }
-
-            return Response(response_data)
+            statistics, version = cached_basic_statistics()
         except:
             return Response(
                 {"message": "Was not possible return the investment informations."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+        # The version served, older than the current one for stale values.
+        return Response(
+            statistics, headers={"ETag": data_version_etag(request, version)}
+        )
+
+
+class InvestmentSeriesView(APIView):
+
+    permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
+
+    @method_decorator(data_version_condition(STATISTICS))
+    def get(self, request):
+        bucket = request.query_params.get("bucket", "day")
+        if bucket not in BUCKETS:
+            return Response(
+                {"message": "bucket must be one of: %s." % ", ".join(BUCKETS)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        dates = {}
+        for param in ("start", "end"):
+            value = request.query_params.get(param)
+            try:
+                dates[param] = parse_date(value) if value else None
+            except ValueError:
+                dates[param] = None
+            if value and not dates[param]:
+                return Response(
+                    {"message": "%s must be a date in YYYY-MM-DD format." % param},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        series, version = cached_series_statistics(bucket, **dates)
+        return Response(series, headers={"ETag": data_version_etag(request, version)})
 
 
 class InvestmentStatisticsTemplateView(TemplateView):
@@ -222,111 +420,53 @@ class InvestmentStatisticsTemplateView(TemplateView):
 
     permission_classes = [IsAuthenticated, (IsAdminUser | IsInvestor | IsAnalyst)]
 
-    @method_decorator(cache_page(60 * 15))
-    def dispatch(self, request, *args, **kwargs):
-        return super().dispatch(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        loans = Loan.objects.all()
-        total_invested_amount = (
-            loans.aggregate(Sum("invested_amount"))["invested_amount__sum"] or 0
-        )
-        context["total_invested_amount"] = total_invested_amount
-        context["num_loans"] = len(loans)
-        context["current_invested_amount"] = (
-            loans.filter(is_closed=False).aggregate(Sum("invested_amount"))[
-                "invested_amount__sum"
-            ]
-            or 0
-        )
-        context["total_repaid_amount"] = (
-            CashFlow.objects.filter(type="Repayment").aggregate(Sum("amount"))[
-                "amount__sum"
-            ]
-            or 0
-        )
-        weighted_realized_irr = ExpressionWrapper(
-            F("invested_amount") * F("realized_irr"), output_field=FloatField()
-        )
-        context["average_realized_irr"] = (
-            loans.filter(is_closed=True)
-            .annotate(weighted_irr=weighted_realized_irr)
-            .aggregate(irr=Sum("weighted_irr") / Sum("invested_amount"))["irr"]
-            or 0
-        )
+        statistics, _ = cached_basic_statistics()
+        context["total_invested_amount"] = statistics["total_invested_amount"]
+        context["num_loans"] = statistics["number_of_loans"]
+        context["current_invested_amount"] = statistics["current_invested_amount"]
+        context["total_repaid_amount"] = statistics["total_repaid_amount"]
+        context["average_realized_irr"] = statistics["average_realized_irr"]
 
-        investment_distribution = []
-        labels = []
-        for loan in loans:
-            if loan.invested_amount:
-                investment_distribution.append(loan.invested_amount)
-                labels.append(loan.identifier)
-        fig = Figure(figsize=(6, 6))
-        ax = fig.add_subplot(111)
-        ax.pie(investment_distribution, labels=labels)
-        ax.set_title("Investment Distribution")
-        canvas = FigureCanvas(fig)
-        buf = io.BytesIO()
-        canvas.print_png(buf)
-        context[
-            "investment_distribution"
-        ] = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
-
-        investment_amounts = []
-        repayment_amounts = []
-        labels = []
-        for loan in loans:
-            if loan.invested_amount:
-                investment_amounts.append(-abs(loan.invested_amount))
-                repayment_amounts.append(
-                    CashFlow.objects.filter(
-                        type="Repayment", loan_identifier=loan.identifier
-                    ).aggregate(Sum("amount"))["amount__sum"]
-                    or 0
-                )
-                labels.append(loan.identifier)
-        fig = Figure(figsize=(6, 6))
-        ax = fig.add_subplot(111)
-        ax.bar(labels, investment_amounts, label="Investment")
-        ax.bar(labels, repayment_amounts, label="Repayment")
-        ax.set_title("Investment and Repayment by Loan")
-        ax.set_xlabel("Loan Identifier")
-        ax.set_ylabel("Amount")
-        ax.legend()
-        canvas = FigureCanvas(fig)
-        buf = io.BytesIO()
-        canvas.print_png(buf)
-        context["investment_repayment"] = "data:image/png;base64," + base64.b64encode(
-            buf.getvalue()
-        ).decode("utf-8")
-
-        cash_flows = CashFlow.objects.all().order_by("reference_date")
-        investment_total = 0
-        repayment_total = 0
-        investment_data = []
-        repayment_data = []
-        date_labels = []
-        for cash_flow in cash_flows:
-            if cash_flow.type == "Funding":
-                investment_total += cash_flow.amount
-            else:
-                repayment_total += cash_flow.amount
-            investment_data.append(abs(investment_total))
-            repayment_data.append(repayment_total)
-            date_labels.append(cash_flow.reference_date.strftime("%Y-%m-%d"))
-        fig = Figure(figsize=(6, 6))
-        ax = fig.add_subplot(111)
-        ax.plot(date_labels, investment_data, label="Investment")
-        ax.plot(date_labels, repayment_data, label="Repayment")
-        ax.set_title("Investment and Repayment over Time")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Amount")
-        ax.legend()
-        canvas = FigureCanvas(fig)
-        buf = io.BytesIO()
-        canvas.print_png(buf)
-        context["investment_over_time"] = "data:image/png;base64," + base64.b64encode(
-            buf.getvalue()
-        ).decode("utf-8")
-        return context
\ No newline at end of file
+        charts, is_current = get_rendered_charts()
+        if not is_current:
+            schedule_chart_rendering()
+        context.update(charts or {})
+        context["charts_rendering"] = not is_current
+        return context
+
+
+class ProfileDetail(APIView):
+    """A profile recorded by ``ProfilingMiddleware``."""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, profile_id):
+        profile = get_profile(profile_id)
+        if profile is None:
+            raise Http404
+        return Response(profile)
+
+
+class MetricsView(View):
+    """Request and CSV import metrics in the Prometheus text format.
+
+    Served to admins and to scrapers sending ``METRICS_TOKEN``, unless
+    ``METRICS_PUBLIC`` is set.
+    """
+
+    def has_access(self, request):
+        if settings.METRICS_PUBLIC:
+            return True
+        token = settings.METRICS_TOKEN
+        if token and constant_time_compare(
+            request.headers.get("Authorization", ""), "Bearer %s" % token
+        ):
+            return True
+        return is_admin(request)
+
+    def get(self, request):
+        if not self.has_access(request):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+        return HttpResponse(metrics.expose(), content_type=metrics.CONTENT_TYPE)